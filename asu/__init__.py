@@ -16,3 +16,33 @@ DEFAULT_OUTPUT_FILE_TYPE = 'png'
 DEFAULT_SCREENSHOT_FILE_EXTENSION = 'png'
 
 DEFAULT_FFMPEG_COMMAND = 'ffmpeg'
+
+
+class AsuError(Exception):
+    """base class of the errors raised by the library API, see asu.api"""
+
+
+class ConfigError(AsuError, ValueError):
+    """an option, or the ffmpeg executable, can not be used"""
+
+
+class InputFileError(AsuError, ValueError):
+    """an input path is neither a video file asu can handle nor a dir"""
+
+
+class UploadError(AsuError, IOError):
+    """no image host took the screenshots"""
+
+
+def process(paths, **cfg):
+    """see asu.api.process(), imported on first use"""
+    from .api import process
+
+    return process(paths, **cfg)
+
+
+def aprocess(paths, **cfg):
+    """see asu.api.aprocess(), imported on first use"""
+    from .api import aprocess
+
+    return aprocess(paths, **cfg)
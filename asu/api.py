@@ -0,0 +1,323 @@
+"""Library API, for programs embedding asu instead of running its command
+line in a new process:
+
+    with asu.api.Session(host='imagebam') as session:
+        for result in session.process(['video.mkv'], amount=4):
+            ...
+
+    async for result in asu.aprocess(['video.mkv'], upload=False):
+        ...
+
+Bad options and paths are raised as exceptions, see asu.AsuError; a file
+which cannot be processed is reported in the `error` of its FileResult."""
+import os
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from . import (VALID_INPUT_FILE_EXTENSIONS, DEFAULT_SCREENSHOT_AMOUNT,
+               AsuError, ConfigError, InputFileError, UploadError)
+from . import upload as hosts, scoring, utils
+from .cache import FileCache, ProbeCache, UploadLedger, HostLimits
+from .discover import Discovery
+from .extract import Extractor
+from .file_type import InputFile
+from .optimize import Optimizer
+from .pipeline import Pipeline
+
+# yielded for every screenshot once it is taken, or uploaded if uploading.
+# `screenshot` is a file_type.ScreenshotFile
+ScreenshotResult = namedtuple('ScreenshotResult', 'input_file, screenshot')
+# yielded for every input file once all of its screenshots are done, after
+# the ScreenshotResults of the file. `error` is the InputFileError or
+# UploadError of a file which could not be processed, None otherwise
+FileResult = namedtuple('FileResult', 'input_file, screenshots, error')
+FileResult.__new__.__defaults__ = (None,)
+
+
+class Session(object):
+    """Takes, and unless `upload` is False uploads, the screenshots of video
+       files. The options are those of the command line and config file.
+
+    With `fallback_hosts`, a list of further host names, each upload goes to
+    the host which was the fastest lately and fails over to the others, see
+    upload.Router; `fallback_logins` maps their names to 'user:password'.
+    `progress` is called with the name of every file uploaded, the bytes of
+    it sent and its size, see multipart.MultipartEncoder.
+
+    The logged in host sessions, the upload and re-encoding pools and the
+    caches are kept from one process() call to the next until close()."""
+
+    def __init__(self, host=None, upload=True, login=None,
+                 thumbnail_size=None, jobs=None, upload_jobs=None,
+                 backlog=None, ffmpeg=None, ffmpeg_args=None,
+                 frame_accurate=False, extract_mode=None, in_memory=False,
+                 memory_budget=None, select=False, spread=None,
+                 scene_threshold=None, image_format=None, image_quality=None,
+                 image_max_size=None, force_upload=False, probe_cache=True,
+                 upload_ledger=True, cache_dir=None,
+                 delete_screenshots=False, fallback_hosts=(),
+                 fallback_logins=None, progress=None):
+        self.ffmpeg = ffmpeg or utils.ffmpeg_exe()
+        cache_dir = os.path.expanduser(cache_dir or utils.cache_dir())
+        hosts.set_cache_dir(cache_dir)
+
+        version_cache = FileCache(os.path.join(cache_dir, 'ffmpeg.json'))
+        version = utils.ffmpeg_version(self.ffmpeg, version_cache)
+        if version is False:
+            raise ConfigError("Failed to run '{}'".format(self.ffmpeg))
+        elif version is None:
+            utils.warn("ffmpeg does not look compatible, errors may occur")
+        self._save(version_cache)
+
+        if select and not scoring.available():
+            raise ConfigError("Selecting screenshots by their content "
+                              "requires NumPy, which is not installed")
+        if in_memory and not upload:
+            raise ConfigError("Screenshots are only kept in memory while "
+                              "uploading them")
+        if delete_screenshots and not upload:
+            raise ConfigError("Screenshots are only deleted after uploading "
+                              "them")
+
+        # set on the input files of this session, rather than shared by
+        # all InputFiles, so that sessions do not switch each other's off
+        self.probe_cache = None
+        if probe_cache:
+            self.probe_cache = ProbeCache(os.path.join(cache_dir,
+                                                       'probe.json'))
+
+        try:
+            self.extractor = Extractor(
+                jobs=jobs, ffmpeg=self.ffmpeg, frame_accurate=frame_accurate,
+                extra_args=ffmpeg_args, mode=extract_mode,
+                in_memory=in_memory, memory_budget=memory_budget,
+                select=select, spread=spread,
+                scene_threshold=scene_threshold)
+        except ValueError as e:
+            raise ConfigError(str(e))
+
+        self.host, self.fallbacks = None, []
+        self.uploader, self.ledger, self.pipeline = None, None, None
+        if not upload:
+            return
+
+        host = host or hosts.default_host
+        for name in (host,) + tuple(fallback_hosts):
+            if name not in hosts.hosts:
+                raise ConfigError("Image host '{}' does not "
+                                  "exist".format(name))
+        Host = hosts.get_host(host)
+
+        if thumbnail_size and thumbnail_size not in Host.thumbnail_sizes:
+            raise ConfigError("Thumbnail size {} is not one of {}".format(
+                thumbnail_size, Host.thumbnail_sizes))
+
+        self.host = self._host(Host, login, thumbnail_size)
+        for name in fallback_hosts:
+            if name != host:
+                self.fallbacks.append(self._host(
+                    hosts.get_host(name), (fallback_logins or {}).get(name),
+                    thumbnail_size or Host.thumbnail_size))
+        for h in [self.host] + self.fallbacks:
+            h.progress = progress
+
+        if upload_ledger:
+            self.ledger = UploadLedger(os.path.join(cache_dir,
+                                                    'uploads.json'))
+
+        optimizer = None
+        if image_format:
+            try:
+                optimizer = Optimizer(image_format, image_quality,
+                                      (image_max_size or 0) * 1024,
+                                      ffmpeg=self.ffmpeg)
+            except ValueError as e:
+                raise ConfigError(str(e))
+
+        self.uploader = hosts.Uploader(self.host, jobs=upload_jobs,
+                                       ledger=self.ledger,
+                                       force=force_upload,
+                                       optimizer=optimizer,
+                                       fallbacks=self.fallbacks,
+                                       limits=HostLimits(os.path.join(
+                                           cache_dir, 'limits.json')))
+        self.pipeline = Pipeline(self.extractor, self.uploader,
+                                 backlog=backlog,
+                                 delete_screenshots=delete_screenshots)
+
+    @staticmethod
+    def _host(Host, login, thumbnail_size):
+        username, password = None, None
+        if login:
+            username, _, password = login.partition(':')
+
+        return Host(username=username, password=password,
+                    thumbnail_size=Host.nearest_thumbnail_size(thumbnail_size))
+
+    @staticmethod
+    def _save(cache):
+        try:
+            cache.save()
+        except (IOError, OSError) as e:
+            utils.warn("Failed to write {}: {}".format(cache.path, e))
+
+    def _input_files(self, paths, recursive, max_depth, include, exclude):
+        for path in paths:
+            if os.path.isdir(path):
+                continue
+
+            input_file = InputFile(path)
+            if not (input_file.exists() and
+                    input_file.ext.lower() in VALID_INPUT_FILE_EXTENSIONS):
+                raise InputFileError("'{}' is not a valid input "
+                                     "file".format(path))
+
+        return self._with_cache(Discovery(paths, recursive=recursive,
+                                          max_depth=max_depth,
+                                          include=include, exclude=exclude))
+
+    def _with_cache(self, input_files):
+        for input_file in input_files:
+            input_file.probe_cache = self.probe_cache
+            yield input_file
+
+    def process(self, paths, amount=None, output_dir=None, recursive=False,
+                max_depth=None, include=(), exclude=()):
+        """take `amount` screenshots of each of the video files and of the
+           files in the dirs of `paths`, and upload them. Yields a
+           ScreenshotResult for every screenshot and a FileResult for every
+           input file as soon as they are done. Screenshots are written to
+           `output_dir`, ./asu_out by default.
+
+           Raises ConfigError for bad options and InputFileError for paths
+           which are not video files, up front. The other files go on when
+           one cannot be processed or uploaded, see FileResult.error"""
+        amount = amount or DEFAULT_SCREENSHOT_AMOUNT
+        if self.host is not None:
+            quantity = self.host.quantity
+            if not quantity.min <= amount <= quantity.max:
+                raise ConfigError("{} can take {} to {} screenshots per "
+                                  "file".format(self.host.name, *quantity))
+        elif amount < 1:
+            raise ConfigError("At least 1 screenshot per file is needed")
+
+        output_dir = os.path.realpath(output_dir or
+                                      os.path.join(os.getcwd(), 'asu_out'))
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        input_files = self._input_files(paths, recursive, max_depth,
+                                        include, exclude)
+
+        if self.pipeline is None:
+            for input_file, screenshot, remaining in self.extractor.iter_run(
+                    input_files, amount, output_dir):
+                if screenshot is not None:
+                    yield ScreenshotResult(input_file, screenshot)
+                if remaining == 0:
+                    yield FileResult(input_file, input_file.screenshots,
+                                     self._error(input_file))
+            return
+
+        try:
+            for input_file in self.pipeline.run(input_files, amount,
+                                                output_dir):
+                error = self._error(input_file)
+                if error is None:
+                    for screenshot in input_file.screenshots:
+                        yield ScreenshotResult(input_file, screenshot)
+                yield FileResult(input_file, input_file.screenshots, error)
+        except AsuError:
+            raise
+        except Exception as e:  # e.g. of the HTTP stack
+            raise UploadError("Uploading failed: {}".format(e)) from e
+
+    @staticmethod
+    def _error(input_file):
+        """the AsuError of a file which could not be processed, if any"""
+        error = input_file.error
+        if error is None or isinstance(error, AsuError):
+            return error
+
+        wrapped = InputFileError("'{}' could not be processed: {}".format(
+            input_file.path, error))
+        wrapped.__cause__ = error
+        return wrapped
+
+    async def aprocess(self, paths, **kwargs):
+        """process() as an asynchronous iterator. The work is done in a
+           thread of its own, one result at a time"""
+        loop = asyncio.get_running_loop()
+        results = self.process(paths, **kwargs)
+        done = object()
+
+        # a single thread, so that close() waits for a next() which is
+        # still running when the iteration is left, e.g. on cancellation
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            while True:
+                result = await loop.run_in_executor(executor, next, results,
+                                                    done)
+                if result is done:
+                    break
+                yield result
+        finally:
+            # stops the extraction and uploads if the iteration was left
+            try:
+                await loop.run_in_executor(executor, results.close)
+            finally:
+                executor.shutdown(wait=False)
+
+    def close(self):
+        """wait for the uploads in progress, end the pools and save the
+           caches"""
+        if self.uploader is not None:
+            self.uploader.close()
+            self._save(self.uploader.limits)
+
+        if self.probe_cache is not None:
+            self._save(self.probe_cache)
+        if self.ledger is not None:
+            self._save(self.ledger)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _split(cfg):
+    """split the keyword arguments of process() into those of the Session
+       and those of Session.process()"""
+    run_keys = ('amount', 'output_dir', 'recursive', 'max_depth', 'include',
+                'exclude')
+    run_cfg = dict((key, cfg.pop(key)) for key in run_keys if key in cfg)
+
+    return cfg, run_cfg
+
+
+def process(paths, **cfg):
+    """Session(**cfg).process(paths) in a session of its own, which is
+       closed once the results are consumed. Keep a Session to reuse the
+       host sessions and pools for several calls"""
+    session_cfg, run_cfg = _split(dict(cfg))
+
+    with Session(**session_cfg) as session:
+        for result in session.process(paths, **run_cfg):
+            yield result
+
+
+async def aprocess(paths, **cfg):
+    """process() as an asynchronous iterator"""
+    session_cfg, run_cfg = _split(dict(cfg))
+
+    session = Session(**session_cfg)
+    try:
+        async for result in session.aprocess(paths, **run_cfg):
+            yield result
+    finally:
+        # waits for the upload pool
+        await asyncio.get_running_loop().run_in_executor(None,
+                                                         session.close)
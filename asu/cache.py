@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .utils import cache_dir
+
+DEFAULT_PROBE_CACHE_SIZE = 2000
+DEFAULT_UPLOAD_LEDGER_SIZE = 20000
+DEFAULT_FILE_CACHE_SIZE = 64
+# seconds after which learned upload limits are no longer trusted, hosts
+# change their policies
+DEFAULT_LIMITS_MAX_AGE = 7 * 24 * 3600
+
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+# most times, e.g. keyframes, cached for one file, see pack_times()
+MAX_CACHED_TIMES = 2000
+
+
+class JsonCache(object):
+    """Small on-disk key/value store kept in a single JSON file.
+
+    Entries are evicted least recently used first once there are more than
+    `max_entries` of them. Changes are only written by save()."""
+
+    version = 1
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        self._entries = OrderedDict()
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except (IOError, OSError, ValueError):
+            return
+
+        if data.get('version') == self.version:
+            self._entries.update((key, value) for key, value in
+                                 data.get('entries', ()))
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._load()
+
+            if key not in self._entries:
+                return default
+
+            value = self._entries.pop(key)
+            self._entries[key] = value  # mark as most recently used
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._load()
+
+            self._entries.pop(key, None)
+            self._entries[key] = value
+
+            if self.max_entries:
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+            self._dirty = True
+
+    def delete(self, key):
+        with self._lock:
+            self._load()
+
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            data = {'version': self.version,
+                    'entries': list(self._entries.items())}
+
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as file:
+                json.dump(data, file, separators=(',', ':'))
+            getattr(os, 'replace', os.rename)(tmp_path, self.path)
+
+            self._dirty = False
+
+
+def file_key(path):
+    """identity of a file: its absolute path, size and modification time"""
+    stat = os.stat(path)
+
+    return '{}|{}|{}'.format(os.path.abspath(path), stat.st_size,
+                             stat.st_mtime)
+
+
+def fingerprint(path, block_size=FINGERPRINT_BLOCK_SIZE):
+    """cheap content fingerprint: hash of the first and last block"""
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as file:
+        digest.update(file.read(block_size))
+
+        file.seek(0, os.SEEK_END)
+        if file.tell() > block_size:
+            file.seek(-block_size, os.SEEK_END)
+            digest.update(file.read(block_size))
+
+    return digest.hexdigest()
+
+
+def pack_times(times, limit=MAX_CACHED_TIMES):
+    """sorted times in seconds as a compact list for the cache: the gaps
+       between them in milliseconds. Long lists are thinned out to `limit`
+       evenly spread times, a keyframe seek then starts a bit earlier"""
+    if len(times) > limit:
+        step = len(times) / float(limit)
+        times = [times[int(i * step)] for i in range(limit)]
+
+    packed, last = [], 0
+    for time_ms in (int(round(t * 1000)) for t in times):
+        packed.append(time_ms - last)
+        last = time_ms
+
+    return packed
+
+
+def unpack_times(packed):
+    times, last = [], 0
+    for gap in packed:
+        last += gap
+        times.append(last / 1000.0)
+
+    return times
+
+
+class ProbeCache(JsonCache):
+    """Persistent cache of probe results of input files, keyed on the path,
+       size and modification time (and optionally a content fingerprint) of
+       each file. A record is a dict, e.g. {'duration': [string, seconds]}"""
+
+    version = 2  # keyframes are packed, see pack_times()
+
+    def __init__(self, path=None, max_entries=DEFAULT_PROBE_CACHE_SIZE,
+                 use_fingerprint=False):
+        path = path or os.path.join(cache_dir(), 'probe.json')
+        super(ProbeCache, self).__init__(path, max_entries)
+
+        self.use_fingerprint = use_fingerprint
+
+    def key(self, path):
+        key = file_key(path)
+        if self.use_fingerprint:
+            key += '|' + fingerprint(path)
+
+        return key
+
+    def lookup(self, path):
+        try:
+            return self.get(self.key(path)) or {}
+        except (IOError, OSError):
+            return {}
+
+    def update(self, path, **fields):
+        try:
+            key = self.key(path)
+        except (IOError, OSError):
+            return
+
+        record = dict(self.get(key) or {})
+        record.update(fields)
+
+        self.set(key, record)
+
+
+class UploadLedger(JsonCache):
+    """Persistent record of uploaded images, keyed on the image host, the
+       thumbnail size and the sha256 of the file. A record is a
+       [page_url, thumbnail_url] list"""
+
+    def __init__(self, path=None, max_entries=DEFAULT_UPLOAD_LEDGER_SIZE):
+        path = path or os.path.join(cache_dir(), 'uploads.json')
+        super(UploadLedger, self).__init__(path, max_entries)
+
+    @staticmethod
+    def key(host, thumbnail_size, digest):
+        return '{}|{}|{}'.format(host, thumbnail_size, digest)
+
+    def lookup(self, host, thumbnail_size, digest):
+        return self.get(self.key(host, thumbnail_size, digest))
+
+    def record(self, host, thumbnail_size, digest, page_url, thumbnail_url):
+        self.set(self.key(host, thumbnail_size, digest),
+                 [page_url, thumbnail_url])
+
+
+class FileCache(JsonCache):
+    """Persistent cache of values derived from files which are expensive to
+       get, like the version of an executable or the metadata of a plugin.
+       Keyed on the path, size and modification time of the file, see
+       file_key(), so that a value is derived again once its file changes"""
+
+    def __init__(self, path, max_entries=DEFAULT_FILE_CACHE_SIZE):
+        super(FileCache, self).__init__(path, max_entries)
+
+    def lookup(self, path):
+        try:
+            return self.get(file_key(path))
+        except (IOError, OSError):
+            return None
+
+    def store(self, path, value):
+        try:
+            self.set(file_key(path), value)
+        except (IOError, OSError):
+            pass
+
+
+class HostLimits(JsonCache):
+    """Persistent upload limits learned for each image host, see
+       upload.Throttle, so that a run starts where the last one left off.
+       A record is a {'in_flight': float, 'rate': float or None, 'time':
+       seconds since the epoch} dict, keyed on the host name"""
+
+    def __init__(self, path=None, max_age=DEFAULT_LIMITS_MAX_AGE):
+        path = path or os.path.join(cache_dir(), 'limits.json')
+        super(HostLimits, self).__init__(path)
+
+        self.max_age = max_age
+
+    def lookup(self, host):
+        record = self.get(host)
+        if record is None or time.time() - record['time'] > self.max_age:
+            return None
+
+        return record
+
+    def record(self, host, in_flight, rate):
+        self.set(host, {'in_flight': in_flight, 'rate': rate,
+                        'time': time.time()})
+
+    def hosts(self):
+        """the names of the hosts with limits recorded"""
+        with self._lock:
+            self._load()
+
+            return sorted(self._entries)
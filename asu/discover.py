@@ -0,0 +1,104 @@
+import os
+from fnmatch import fnmatch
+
+from . import VALID_INPUT_FILE_EXTENSIONS
+from .file_type import InputFile
+
+
+def _matches(patterns, name, relpath):
+    return any(fnmatch(name, p) or fnmatch(relpath, p) for p in patterns)
+
+
+def name_prefix(directory, path):
+    """the screenshot name prefix of a file found below `directory`: its
+       sub-dir, e.g. 's1_' for 's1/ep.mkv', see InputFile"""
+    subdir = os.path.relpath(os.path.dirname(path), directory)
+    if subdir == os.curdir:
+        return ''
+
+    return subdir.replace(os.sep, '_') + '_'
+
+
+def walk(directory, recursive=False, max_depth=None, include=(),
+         exclude=(), extensions=VALID_INPUT_FILE_EXTENSIONS):
+    """lazily yield the paths of the eligible files below `directory`.
+
+    Entries are filtered on their extension before anything else is done
+    with them. `max_depth` limits how many levels of sub-directories are
+    entered when `recursive` is set. Glob patterns in `include` and
+    `exclude` are matched against both the name and the path relative to
+    `directory`; excluded directories are not entered."""
+    extensions = frozenset(ext.lower() for ext in extensions)
+    if not recursive:
+        max_depth = 0
+
+    stack = [(directory, 0)]
+    while stack:
+        path, depth = stack.pop()
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            continue
+
+        may_enter = max_depth is None or depth < max_depth
+
+        subdirs = []
+        for entry in entries:
+            ext = entry.name.rpartition('.')[2].lower()
+            is_candidate = '.' in entry.name and ext in extensions
+
+            try:
+                if is_candidate and entry.is_file():
+                    is_dir = False
+                elif may_enter and entry.is_dir(follow_symlinks=False):
+                    is_dir = True
+                else:
+                    continue
+            except OSError:
+                continue
+
+            relpath = None
+            if include or exclude:
+                relpath = os.path.relpath(entry.path, directory)
+            if exclude and _matches(exclude, entry.name, relpath):
+                continue
+
+            if is_dir:
+                subdirs.append(entry.path)
+            elif not include or _matches(include, entry.name, relpath):
+                yield entry.path
+
+        # depth first, in name order
+        stack.extend((subdir, depth + 1) for subdir in reversed(subdirs))
+
+
+class Discovery(object):
+    """Iterates over the InputFile objects of the given file and directory
+       arguments, walking directories lazily. Every InputFile handed out is
+       also kept in `found`, in order."""
+
+    def __init__(self, paths, recursive=False, max_depth=None, include=(),
+                 exclude=()):
+        self.paths = paths
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.include = include
+        self.exclude = exclude
+
+        self.found = []
+
+    def _paths(self):
+        for path in self.paths:
+            if os.path.isdir(path):
+                for file_path in walk(path, self.recursive, self.max_depth,
+                                      self.include, self.exclude):
+                    yield file_path, name_prefix(path, file_path)
+            else:
+                yield path, ''
+
+    def __iter__(self):
+        for path, prefix in self._paths():
+            input_file = InputFile(path, prefix)
+            self.found.append(input_file)
+
+            yield input_file
@@ -0,0 +1,349 @@
+import time
+import threading
+from functools import partial
+from multiprocessing import cpu_count, TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from .file_type import DEFAULT_SPREAD
+from .scenes import DEFAULT_THRESHOLD
+from .utils import warn
+
+# 'frame': one ffmpeg process per screenshot
+# 'single': one ffmpeg process per input file, taking all of its screenshots
+MODES = ('frame', 'single')
+DEFAULT_MODE = 'frame'
+
+# max bytes of screenshots kept in memory at once, see Extractor.in_memory
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+# assumed size of an in-memory screenshot of unknown resolution
+DEFAULT_SCREENSHOT_SIZE = 8 * 1024 * 1024
+
+
+def default_jobs():
+    try:
+        return cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class MemoryBudget(object):
+    """Accounts the bytes of screenshots held in memory, acquire() blocks
+       while taking `size` more bytes would exceed the limit"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+
+        self._cond = threading.Condition()
+
+    def acquire(self, size, stopped=None):
+        """returns the amount of bytes acquired, None if `stopped` was set
+           while waiting"""
+        size = min(size, self.limit)  # one request is always allowed
+
+        with self._cond:
+            while self.used and self.used + size > self.limit:
+                self._cond.wait(0.1)
+                if stopped is not None and stopped.is_set():
+                    return None
+            self.used += size
+
+        return size
+
+    def resize(self, old_size, new_size):
+        with self._cond:
+            self.used += new_size - old_size
+            self._cond.notify_all()
+
+    def release(self, size):
+        self.resize(size, 0)
+
+
+class Extractor(object):
+    """Takes the screenshots of several input files using a bounded pool of
+       worker threads, each of which drives one ffmpeg process at a time.
+
+    With `in_memory` screenshots are not written to the output dir, but read
+    from ffmpeg's stdout and kept in memory, in total no more than about
+    `memory_budget` bytes, until ScreenshotFile.free() is called."""
+
+    def __init__(self, jobs=None, ffmpeg=None, frame_accurate=False,
+                 extra_args=None, mode=None, manifest=None, in_memory=False,
+                 memory_budget=None, select=False, spread=None,
+                 scene_threshold=None):
+        if mode is not None and mode not in MODES:
+            raise ValueError("unknown extraction mode '{}'".format(mode))
+        if in_memory and mode == 'single':
+            raise ValueError("single pass extraction cannot keep screenshots "
+                             "in memory")
+
+        self.jobs = max(1, jobs or default_jobs())
+        self.mode = mode or DEFAULT_MODE
+        self.ffmpeg = ffmpeg
+        self.frame_accurate = frame_accurate
+        self.extra_args = extra_args
+        self.manifest = manifest  # manifest.Manifest of a resumable run
+        self.in_memory = in_memory
+        self.memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET
+        # see InputFile.plan_screenshots()
+        self.select = select
+        self.spread = spread or DEFAULT_SPREAD
+        self.scene_threshold = scene_threshold or DEFAULT_THRESHOLD
+
+    def _probe(self, input_file):
+        if self.manifest is None:
+            input_file.get_duration(self.ffmpeg)
+        elif not self.manifest.restore_probe(input_file):
+            input_file.get_duration(self.ffmpeg)
+            self.manifest.add_probed(input_file)
+
+        if self.frame_accurate:  # read once, before any screenshot is taken
+            input_file.get_keyframes(self.ffmpeg)
+
+        return input_file
+
+    def _plan(self, input_file, amount, output_dir):
+        try:
+            self._probe(input_file)
+
+            return input_file, input_file.plan_screenshots(
+                amount, output_dir, self.ffmpeg, self.select, self.spread,
+                self.scene_threshold)
+        except Exception as e:  # the other files go on
+            warn("Failed to probe '{}': {}".format(input_file.path, e))
+            input_file.error = e
+
+            return input_file, []
+
+    @staticmethod
+    def _estimate_size(input_file):
+        media_info = input_file.media_info
+        if media_info is not None and media_info.width and media_info.height:
+            return media_info.width * media_info.height * 3
+
+        return DEFAULT_SCREENSHOT_SIZE
+
+    def _reserve(self, memory, input_file, tasks, stopped):
+        """reserve memory for all screenshots of an input file at once, so
+           that files are never stuck waiting for their own last screenshots.
+           Returns the bytes reserved per screenshot, None if stopped"""
+        todo = sum(len(task[1]) for task in tasks if task[3] is None)
+        if not todo:
+            return 0
+
+        size = memory.acquire(todo * self._estimate_size(input_file), stopped)
+        if size is None:
+            return None
+
+        share = size // todo
+        memory.release(size - share * todo)
+
+        return share
+
+    def _capture(self, input_file, timecode, path, memory, size):
+        screenshot = input_file.capture_screenshot(path, timecode, self.ffmpeg,
+                                                   self.frame_accurate,
+                                                   self.extra_args)
+        if screenshot is None:
+            memory.release(size)
+            return None
+
+        actual_size = len(screenshot.data.getbuffer())
+        memory.resize(size, actual_size)
+        screenshot._on_free = partial(memory.release, actual_size)
+
+        return screenshot
+
+    def _extract(self, task, memory=None):
+        input_file, numbers, plan, restored, reserved = task
+
+        start = time.time()
+        if not plan:  # probing failed
+            screenshots = []
+        elif restored is not None:  # taken by an earlier run
+            screenshots = restored
+        elif memory is not None:
+            (timecode, path), = plan
+            screenshots = [self._capture(input_file, timecode, path, memory,
+                                         reserved)]
+        elif self.mode == 'single':
+            screenshots = input_file.extract_screenshots(plan, self.ffmpeg,
+                                                         self.frame_accurate,
+                                                         self.extra_args)
+        else:
+            (timecode, path), = plan
+            screenshots = [input_file.extract_screenshot(path, timecode,
+                                                         self.ffmpeg,
+                                                         self.frame_accurate,
+                                                         self.extra_args)]
+
+        return (input_file, numbers, screenshots, restored is not None,
+                start, time.time())
+
+    def _tasks(self, input_file, plan):
+        restored = {}
+        if self.manifest is not None:
+            for number, (timecode, path) in enumerate(plan):
+                screenshot = self.manifest.restore_screenshot(input_file,
+                                                              timecode, path)
+                if screenshot is not None:
+                    restored[number] = screenshot
+
+        tasks = [(input_file, [number], [plan[number]], [screenshot])
+                 for number, screenshot in sorted(restored.items())]
+
+        todo = [number for number in range(len(plan))
+                if number not in restored]
+        if self.mode == 'single' and todo:
+            tasks.append((input_file, todo, [plan[n] for n in todo], None))
+        else:
+            tasks += [(input_file, [number], [plan[number]], None)
+                      for number in todo]
+
+        return tasks
+
+    def _acquire(self, slots, amount, stopped):
+        for _ in range(amount):
+            while not slots.acquire(timeout=0.1):
+                if stopped.is_set():
+                    return False
+
+        return True
+
+    @staticmethod
+    def _results(results, tick):
+        while True:
+            try:
+                yield results.next(tick)
+            except TimeoutError:
+                yield None
+            except StopIteration:
+                return
+
+    def iter_run(self, input_files, amount, output_dir, slots=None,
+                 tick=None):
+        """take `amount` screenshots of every input file and yield an
+           (input_file, screenshot, remaining) tuple as soon as each of them
+           is taken. `screenshot` is None if it failed, `remaining` is the
+           amount of screenshots of the input file still to come. Once it
+           reaches 0 the screenshots are attached to the InputFile in
+           timecode order.
+
+           If given, one slot of the `slots` semaphore is acquired before
+           each screenshot is taken, which bounds the amount of screenshots
+           waiting to be consumed. Slots of failed screenshots are released
+           here, all others need to be released by the consumer.
+
+           A file which could not be probed is yielded once, with no
+           screenshot, `remaining` 0 and its `error` set.
+
+           With `tick`, (None, None, None) is yielded whenever no screenshot
+           was taken for `tick` seconds."""
+        pool = ThreadPool(self.jobs)
+        # probing and planning, which may decode frames to select them, run
+        # in their own pool, whose task handler thread consumes
+        # `input_files`, so extraction starts while a lazy iterable of
+        # input files is still being produced
+        probe_pool = ThreadPool(self.jobs)
+        stopped = threading.Event()
+
+        memory = None
+        if self.in_memory:
+            memory = MemoryBudget(self.memory_budget)
+
+        results = {}
+        remaining = {}
+        spans = {}
+
+        # submitted from here, the tasks() generator runs in the thread
+        # handing out the tasks of the pool
+        planned = probe_pool.imap(partial(self._plan, amount=amount,
+                                          output_dir=output_dir), input_files)
+
+        def tasks():
+            for input_file, plan in planned:
+                results[id(input_file)] = [None] * len(plan)
+                remaining[id(input_file)] = len(plan)
+
+                if not plan:  # handed on to be reported as done
+                    yield input_file, [], [], None, 0
+                    continue
+
+                file_tasks = self._tasks(input_file, plan)
+
+                reserved = 0
+                if memory is not None:
+                    reserved = self._reserve(memory, input_file, file_tasks,
+                                             stopped)
+                    if reserved is None:
+                        return
+
+                for task in file_tasks:
+                    if slots is not None and \
+                            not self._acquire(slots, len(task[1]), stopped):
+                        return
+                    yield task + (reserved,)
+
+        try:
+            for result in self._results(
+                    pool.imap_unordered(partial(self._extract, memory=memory),
+                                        tasks()), tick):
+                if result is None:
+                    yield None, None, None
+                    continue
+
+                input_file, numbers, screenshots, restored, start, end = result
+                key = id(input_file)
+
+                if not numbers:
+                    del results[key], remaining[key]
+                    yield input_file, None, 0
+                    continue
+
+                first, last = spans.get(key, (start, end))
+                spans[key] = (min(first, start), max(last, end))
+
+                for number, screenshot in zip(numbers, screenshots):
+                    if screenshot is None:
+                        warn("Failed to take screenshot {} of '{}'".format(
+                            number + 1, input_file.path))
+                        if slots is not None:
+                            slots.release()
+                    elif self.manifest is not None and not restored:
+                        self.manifest.add_screenshot(screenshot)
+                    results[key][number] = screenshot
+
+                    remaining[key] -= 1
+                    if remaining[key] == 0:
+                        input_file.screenshots += [ss for ss in
+                                                   results.pop(key)
+                                                   if ss is not None]
+
+                        first, last = spans.pop(key)
+                        input_file.extract_time = last - first
+
+                    yield input_file, screenshot, remaining[key]
+        finally:
+            stopped.set()
+            # an endless iterable of input files, like a watch.Watcher, has
+            # to end before the probe pool's task handler thread can finish
+            stop = getattr(input_files, 'stop', None)
+            if stop is not None:
+                stop()
+
+            pool.terminate()
+            pool.join()
+            probe_pool.terminate()
+            probe_pool.join()
+
+    def run(self, input_files, amount, output_dir):
+        """take `amount` screenshots of every input file, the screenshots are
+           attached to each InputFile in timecode order. Returns the list of
+           input files"""
+        done = []
+        for input_file, _, remaining in self.iter_run(input_files, amount,
+                                                      output_dir):
+            if remaining == 0:
+                done.append(input_file)
+
+        return done
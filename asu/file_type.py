@@ -1,15 +1,39 @@
+import io
 import os
 import sys
 import re
+import bisect
 from collections import namedtuple
 
 from . import (DEFAULT_OUTPUT_FILE_TYPE, DEFAULT_SCREENSHOT_FILE_EXTENSION,
-               DEFAULT_FFMPEG_COMMAND)
-from . import markup
-from .utils import quote_path, run_command, regex_in_string
+               DEFAULT_FFMPEG_COMMAND, InputFileError)
+from . import markup, scenes, scoring
+from .metrics import timed, file_size
+from .probe import MediaInfo, probe, keyframes as probe_keyframes
+from .utils import quote_path, run_command, regex_in_string, ffprobe_exe
+from .cache import pack_times, unpack_times
 
 Timecode = namedtuple('Timecode', "string, seconds")
 
+FRAME_ACCURATE_PREROLL = 30  # seconds decoded when the GOP size is unknown
+END_MARGIN = 1.0  # seconds kept clear of the end of the input file
+
+# how the screenshots of an input file are spread over its duration:
+# 'even': evenly spaced
+# 'scenes': at scene cuts, see scenes.pick()
+SPREADS = ('even', 'scenes')
+DEFAULT_SPREAD = 'even'
+
+
+def format_timecode(seconds):
+    return "{}:{:02}:{:02}".format(int(seconds / (60 * 60)),
+                                   int((seconds / 60) % 60),
+                                   int(seconds % 60))
+
+
+def _seconds_arg(seconds):
+    return '{:.3f}'.format(seconds) if seconds % 1 else str(int(seconds))
+
 
 class AsuFile(object):
     def __init__(self, path):
@@ -27,10 +51,27 @@ class AsuFile(object):
 
 class InputFile(AsuFile):
     duration = Timecode(None, None)
+    extract_time = None  # wall time spent taking screenshots, in seconds
+    error = None  # why the file could not be processed, if it could not
 
-    def __init__(self, path):
+    media_info = None  # probe.MediaInfo, see get_media_info()
+    _probed = False
+
+    keyframes = None  # sorted keyframe times, see get_keyframes()
+    scene_cuts = None  # (threshold, sorted cut times), see get_scenes()
+
+    # cache.ProbeCache shared by all instances, if any, unless an instance
+    # has its own, e.g. that of an api.Session
+    probe_cache = None
+
+    def __init__(self, path, name_prefix=''):
         super(InputFile, self).__init__(path)
 
+        # put before the names of the screenshots, e.g. the sub-dir of the
+        # walked dir the file was found in, so that files of the same name
+        # in different dirs do not overwrite each other's screenshots
+        self.name_prefix = name_prefix
+
         self.screenshots = []
 
     def __repr__(self):
@@ -43,12 +84,96 @@ class InputFile(AsuFile):
             return "InputFile({}, {})".format(self.path,
                                               self.get_duration().string)
 
+    def get_media_info(self, ffmpeg=None):
+        """probe the file with ffprobe, returns a probe.MediaInfo or None if
+           ffprobe is not available or failed"""
+        if self._probed:
+            return self.media_info
+
+        if self.probe_cache is not None:
+            cached = self.probe_cache.lookup(self.path).get('media')
+            if cached:
+                self.media_info = MediaInfo(*cached)
+                self._probed = True
+                return self.media_info
+
+        self.media_info = probe(self.path, ffprobe_exe(ffmpeg))
+        self._probed = True
+
+        if self.media_info is not None and self.probe_cache is not None:
+            self.probe_cache.update(self.path, media=list(self.media_info))
+
+        return self.media_info
+
+    def get_keyframes(self, ffmpeg=None):
+        """return the sorted times of the keyframes of the default video
+           stream, an empty list if they could not be read"""
+        if self.keyframes is not None:
+            return self.keyframes
+
+        if self.probe_cache is not None:
+            cached = self.probe_cache.lookup(self.path).get('keyframes')
+            if cached:
+                self.keyframes = unpack_times(cached)
+                return self.keyframes
+
+        media_info = self.get_media_info(ffmpeg)
+        stream_index = media_info.stream_index if media_info else None
+
+        self.keyframes = probe_keyframes(self.path, ffprobe_exe(ffmpeg),
+                                         stream_index) or []
+
+        if self.keyframes and self.probe_cache is not None:
+            self.probe_cache.update(self.path,
+                                    keyframes=pack_times(self.keyframes))
+
+        return self.keyframes
+
+    def get_scenes(self, ffmpeg=None, threshold=scenes.DEFAULT_THRESHOLD):
+        """return the sorted times of the scene cuts of the default video
+           stream. They are cached with the probe results, so that only the
+           first call for a file and threshold decodes any frames"""
+        if self.scene_cuts is not None and self.scene_cuts[0] == threshold:
+            return self.scene_cuts[1]
+
+        if self.probe_cache is not None:
+            cached = self.probe_cache.lookup(self.path).get('scenes')
+            if cached and cached[0] == threshold:
+                self.scene_cuts = tuple(cached)
+                return self.scene_cuts[1]
+
+        self.get_media_info(ffmpeg)
+        cuts = scenes.detect(self.path, ffmpeg, threshold, self._map_arg(0))
+        if cuts is None:  # ffmpeg failed, tried again on the next call
+            return []
+        self.scene_cuts = (threshold, cuts)
+
+        # videos without cuts too, so that they are not decoded again
+        if self.probe_cache is not None:
+            self.probe_cache.update(self.path, scenes=list(self.scene_cuts))
+
+        return self.scene_cuts[1]
+
+    @timed('probe')
     def get_duration(self, ffmpeg=None):
         ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
 
         if self.duration != (None, None):
             return self.duration
 
+        media_info = self.get_media_info(ffmpeg)
+        if media_info is not None:
+            seconds = media_info.duration_ms / 1000.0
+            self.duration = Timecode(format_timecode(seconds), seconds)
+            return self.duration
+
+        # no ffprobe, fall back to scraping the output of `ffmpeg -i`
+        if self.probe_cache is not None:
+            cached = self.probe_cache.lookup(self.path).get('duration')
+            if cached:
+                self.duration = Timecode(*cached)
+                return self.duration
+
         if 'win32' in sys.platform:
             path = quote_path(self.path)
         else:
@@ -67,19 +192,57 @@ class InputFile(AsuFile):
 
         self.duration = Timecode(dur_string, dur_seconds)
 
+        if self.probe_cache is not None:
+            self.probe_cache.update(self.path, duration=list(self.duration))
+
         return self.duration
 
-    def make_screenshot(self, path, timecode, ffmpeg=None,
-                        frame_accurate=False, extra_args=None):
-        ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
+    def _preroll(self):
+        """seconds to decode before the target frame for frame accurate
+           screenshots without a keyframe index, enough to always start at
+           a keyframe"""
+        if self.media_info is not None and self.media_info.keyframe_interval:
+            return 2 * self.media_info.keyframe_interval
 
-        args = ['-y']
+        return FRAME_ACCURATE_PREROLL
 
-        if frame_accurate:
-            if timecode > 30:
-                args += ['-ss', str(timecode - 30)]
-        else:
-            args += ['-ss', str(timecode)]
+    def _seek_args(self, timecode, frame_accurate):
+        """return the ffmpeg input and output options seeking to `timecode`"""
+        if not frame_accurate:
+            return ['-ss', _seconds_arg(timecode)], []
+
+        if self.keyframes:
+            # seek straight to the preceding keyframe, then decode only the
+            # frames between it and the target
+            index = bisect.bisect_right(self.keyframes, timecode) - 1
+            if index >= 0:
+                keyframe = self.keyframes[index]
+
+                input_args = []
+                if keyframe > 0:
+                    input_args = ['-ss', _seconds_arg(keyframe)]
+
+                return input_args, ['-ss', _seconds_arg(timecode - keyframe)]
+
+        preroll = min(timecode, self._preroll())
+
+        input_args = []
+        if timecode > preroll:
+            input_args = ['-ss', _seconds_arg(timecode - preroll)]
+
+        return input_args, ['-ss', _seconds_arg(preroll)]
+
+    def _map_arg(self, input_index):
+        if self.media_info is not None:
+            return '{}:{}'.format(input_index, self.media_info.stream_index)
+
+        return '{}:v:0'.format(input_index)
+
+    def _screenshot_args(self, output, timecode, frame_accurate=False,
+                         extra_args=None):
+        input_args, output_args = self._seek_args(timecode, frame_accurate)
+
+        args = ['-y'] + input_args
 
         args.append('-i')
         if 'win32' in sys.platform:
@@ -87,46 +250,182 @@ class InputFile(AsuFile):
         else:
             args.append(self.path)
 
-        if frame_accurate:
-            args += ['-ss', "30" if timecode > 30 else str(timecode)]
-
+        if self.media_info is not None:
+            args += ['-map', self._map_arg(0)]
+        args += output_args
         args += ['-vframes', '1', '-vcodec', DEFAULT_OUTPUT_FILE_TYPE]
 
+        if output == '-':
+            args += ['-f', 'image2pipe']
+
         if 'win32' in sys.platform:
             if extra_args:
                 args.append(extra_args)
-            args.append(quote_path(path))
+            args.append(quote_path(output) if output != '-' else output)
         else:
             if extra_args:
                 args += extra_args.split(' ')
-            args.append(path)
+            args.append(output)
 
-        run_command(ffmpeg, *args)
+        return args
+
+    @timed('extract', size=lambda ss, args: ss and file_size(ss.path))
+    def extract_screenshot(self, path, timecode, ffmpeg=None,
+                           frame_accurate=False, extra_args=None):
+        """take a single screenshot without attaching it to this file, safe
+           to call from multiple threads at once"""
+        ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
+
+        run_command(ffmpeg, *self._screenshot_args(path, timecode,
+                                                   frame_accurate, extra_args))
 
         if not os.path.isfile(path):
             return None  # might be a better idea to raise an exception
 
-        screenshot = ScreenshotFile(path, timecode, self)
+        return ScreenshotFile(path, timecode, self)
+
+    @timed('extract', size=lambda ss, args: ss and file_size(ss.data))
+    def capture_screenshot(self, path, timecode, ffmpeg=None,
+                           frame_accurate=False, extra_args=None):
+        """like extract_screenshot(), but the image is read from ffmpeg's
+           stdout into the `data` buffer of the ScreenshotFile instead of
+           being written to `path`, which only serves as its name"""
+        ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
+
+        _, stdout, _ = run_command(ffmpeg, *self._screenshot_args(
+            '-', timecode, frame_accurate, extra_args))
 
-        self.screenshots.append(screenshot)
+        if not stdout:
+            return None
+
+        screenshot = ScreenshotFile(path, timecode, self)
+        screenshot.data = io.BytesIO(stdout)  # shares the bytes, no copy
+        screenshot.data.name = path
 
         return screenshot
 
-    def make_screenshots(self, amount, output_dir, ffmpeg=None,
-                         frame_accurate=False, extra_args=None):
+    @timed('extract', size=lambda screenshots, args: sum(
+        file_size(ss.path) for ss in screenshots if ss is not None))
+    def extract_screenshots(self, plan, ffmpeg=None, frame_accurate=False,
+                            extra_args=None):
+        """take all screenshots of a plan, as returned by plan_screenshots(),
+           with a single ffmpeg process. Returns a list of ScreenshotFile
+           objects (None for failed screenshots) in the order of the plan"""
+        ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
+
+        if 'win32' in sys.platform:
+            input_path = quote_path(self.path)
+        else:
+            input_path = self.path
+
+        args = ['-y']
+
+        for timecode, _ in plan:
+            input_args, _ = self._seek_args(timecode, frame_accurate)
+            args += input_args + ['-i', input_path]
+
+        for index, (timecode, path) in enumerate(plan):
+            _, output_args = self._seek_args(timecode, frame_accurate)
+            args += ['-map', self._map_arg(index)] + output_args
+
+            args += ['-vframes', '1', '-vcodec', DEFAULT_OUTPUT_FILE_TYPE]
+
+            if 'win32' in sys.platform:
+                if extra_args:
+                    args.append(extra_args)
+                args.append(quote_path(path))
+            else:
+                if extra_args:
+                    args += extra_args.split(' ')
+                args.append(path)
+
+        run_command(ffmpeg, *args)
+
         screenshots = []
+        for timecode, path in plan:
+            if os.path.isfile(path):
+                screenshots.append(ScreenshotFile(path, timecode, self))
+            else:
+                screenshots.append(None)
 
-        for number in range(1, amount + 1):
-            from os.path import splitext, join
+        return screenshots
+
+    def make_screenshot(self, path, timecode, ffmpeg=None,
+                        frame_accurate=False, extra_args=None):
+        screenshot = self.extract_screenshot(path, timecode, ffmpeg,
+                                             frame_accurate, extra_args)
+
+        if screenshot is not None:
+            self.screenshots.append(screenshot)
 
-            timecode = int(self.get_duration(ffmpeg).seconds / (amount + 1) *
-                           number)
+        return screenshot
 
-            filename = (splitext(self.filename)[0] +
+    def plan_screenshots(self, amount, output_dir, ffmpeg=None, select=False,
+                         spread=DEFAULT_SPREAD,
+                         scene_threshold=scenes.DEFAULT_THRESHOLD):
+        """return a list of (timecode, output path) tuples, one for each of
+           the screenshots to be taken, spread over the file as set by
+           `spread`, see SPREADS. With `select`, the timecodes are moved to
+           nearby frames which are not black, blank or near duplicates, see
+           scoring.select()"""
+        from os.path import splitext, join
+
+        duration = self.get_duration(ffmpeg)
+        if duration is None:
+            raise InputFileError("Failed to get the duration of "
+                                 "'{}'".format(self.path))
+        duration = duration.seconds
+
+        media_info = self.get_media_info(ffmpeg)
+        if media_info is not None:
+            # seeking to the very last frames tends to yield no or black
+            # frames, keep clear of them
+            fps = media_info.fps or 25
+            duration = max(0, duration - max(END_MARGIN, 2.0 / fps))
+
+        timecodes = []
+        if spread == 'scenes':
+            cuts = self.get_scenes(ffmpeg, scene_threshold)
+            timecodes = scenes.pick(cuts, amount, duration)
+        else:
+            for number in range(1, amount + 1):
+                timecode = duration / (amount + 1) * number
+                if media_info is not None:
+                    timecode = round(timecode, 3)
+                else:
+                    timecode = int(timecode)
+                timecodes.append(timecode)
+
+        if select:
+            timecodes = scoring.select(self.path, timecodes, duration, ffmpeg,
+                                       self._map_arg(0))
+
+        plan = []
+        for number, timecode in enumerate(timecodes, 1):
+            filename = (self.name_prefix + splitext(self.filename)[0] +
                         '_screenshot{:02}'.format(number) + '.' +
                         DEFAULT_SCREENSHOT_FILE_EXTENSION)
-            output_path = join(output_dir, filename)
+            plan.append((timecode, join(output_dir, filename)))
+
+        return plan
+
+    def iter_screenshots(self, amount, output_dir, ffmpeg=None,
+                         frame_accurate=False, extra_args=None):
+        """like make_screenshots(), but yields every ScreenshotFile as soon as
+           it has been taken, failed screenshots are skipped"""
+        for timecode, output_path in self.plan_screenshots(amount, output_dir,
+                                                           ffmpeg):
+            screenshot = self.make_screenshot(output_path, timecode, ffmpeg,
+                                              frame_accurate, extra_args)
+            if screenshot is not None:
+                yield screenshot
+
+    def make_screenshots(self, amount, output_dir, ffmpeg=None,
+                         frame_accurate=False, extra_args=None):
+        screenshots = []
 
+        for timecode, output_path in self.plan_screenshots(amount, output_dir,
+                                                           ffmpeg):
             screenshot = self.make_screenshot(output_path, timecode, ffmpeg,
                                               frame_accurate, extra_args)
 
@@ -139,16 +438,16 @@ class ScreenshotFile(AsuFile):
     timecode = Timecode(None, None)
     page_url = None
     thumbnail_url = None
+    host = None  # name of the image host that took it
+
+    data = None  # file object holding the image, if it is kept in memory
+    _on_free = None
 
     def __init__(self, path, timecode=None, input_file=None):
         super(ScreenshotFile, self).__init__(path)
 
         if timecode:
-            fmt = "{}:{:02}:{:02}"
-            timecode_str = fmt.format(int(timecode / (60 * 60)),
-                                      int((timecode / 60) % 60),
-                                      int(timecode % 60))
-            self.timecode = Timecode(timecode_str, timecode)
+            self.timecode = Timecode(format_timecode(timecode), timecode)
 
         self.input_file = input_file
 
@@ -159,13 +458,52 @@ class ScreenshotFile(AsuFile):
         else:
             return "ScreenshotFile({})".format(self.path)
 
+    @property
+    def source(self):
+        """what to hand to an image host: the in-memory data or the path"""
+        return self.data if self.data is not None else self.path
+
+    def free(self):
+        """drop the in-memory data of the screenshot"""
+        if self.data is not None:
+            self.data = None
+
+            if self._on_free is not None:
+                self._on_free()
+                self._on_free = None
+
 
 ScreenshotInfo = namedtuple('ScreenshotInfo', 'timecode, page_url, '
                             'thumbnail_url')
 
 
 class HtmlFile(AsuFile):
-    sections = []  # tuples: (filename, [ScreenshotInfo])
+    """The html page listing the screenshots of every input file.
+
+    Either written at once by write(), or streamed: append_section() adds
+    the section of an input file to the page right away, which is complete
+    and valid after each section."""
+
+    HEADER = ("<?xml version=\"1.0\"?>\n<html>\n<head>\n<style>\n"
+              ".box-shadow {\n"
+              "  -moz-box-shadow: 3px 3px 5px #000000;\n"
+              "  -webkit-box-shadow: 3px 3px 5px #000000;\n"
+              "  box-shadow: 3px 3px 5px #000000;\n"
+              "}\n"
+              "</style>\n</head>\n<body>\n")
+    FOOTER = "\n</body>\n</html>\n"
+
+    MARKUP = (markup.to_html, markup.to_bbcode, markup.to_url)
+    TEXTAREA_NAMES = ('HTML', 'BBcode', 'URLs')
+    INPUT_BOX_NAMES = ('HTML', 'BBcode', 'URL')
+
+    def __init__(self, path):
+        super(HtmlFile, self).__init__(path)
+
+        self.sections = []  # tuples: (filename, [ScreenshotInfo])
+
+        self._file = None  # open while streaming
+        self._footer_at = None  # offset at which the next section goes
 
     def add_section(self, input_file):
         info_list = []
@@ -177,11 +515,7 @@ class HtmlFile(AsuFile):
         self.sections.append((input_file.filename, info_list))
 
     @staticmethod
-    def _generate_textarea(name, info_list, convert_func):
-        links = []
-        for info in info_list:
-            links.append(convert_func(info.page_url, info.thumbnail_url))
-
+    def _generate_textarea(name, links):
         return ("<td>\n"
                 "<b>{}</b><br />\n"
                 "<textarea onclick='this.select();' style="
@@ -197,54 +531,87 @@ class HtmlFile(AsuFile):
                 "onClick='this.select();' value='{}' />"
                 "</div>\n".format(name, link))
 
-    def write(self):
-        file = open(self.path, "w")
+    def _render_section(self, filename, info_list):
+        # screenshots the host returned no links for are left out
+        info_list = [info for info in info_list if info.page_url is not None]
+        # every markup of a screenshot is used twice, render it once
+        links = [[func(info.page_url, info.thumbnail_url)
+                  for func in self.MARKUP] for info in info_list]
 
-        file.write("<?xml version=\"1.0\"?>\n<html>\n<head>\n<style>\n"
-                   ".box-shadow {\n"
-                   "  -moz-box-shadow: 3px 3px 5px #000000;\n"
-                   "  -webkit-box-shadow: 3px 3px 5px #000000;\n"
-                   "  box-shadow: 3px 3px 5px #000000;\n"
-                   "}\n"
-                   "</style>\n</head>\n<body>\n")
+        parts = ["<font size='5' style='font-weight:bold;'>{}</font>\n"
+                 "<hr width='100%'>\n".format(filename),
+                 "<table style='width:0%;'><td>\n"]
 
-        for filename, info_list in self.sections:
-            file.write("<font size='5' style='font-weight:bold;'>{}</font>\n"
-                       "<hr width='100%'>\n".format(filename))
+        for i, name in enumerate(self.TEXTAREA_NAMES):
+            parts.append(self._generate_textarea(
+                name, [ss_links[i] for ss_links in links]))
 
-            file.write("<table style='width:0%;'><td>\n")
+        parts.append("</table>\n")
 
-            for name, func in (('HTML', markup.to_html),
-                               ('BBcode', markup.to_bbcode),
-                               ('URLs', markup.to_url)):
-                file.write(self._generate_textarea(name, info_list, func))
+        for ss_info, ss_links in zip(info_list, links):
+            parts.append("<table class=box-shadow "
+                         "style='position:relative;'>\n"
+                         "<tr><td rowspan=2>{}</td>".format(ss_links[0]))
 
-            file.write("</table>\n")
+            if ss_info.timecode:
+                parts.append("<td><font style='font-weight:bold; "
+                             "position: absolute; right:0px;\'>{0}</font>"
+                             "</td>".format(ss_info.timecode))
 
-            for ss_info in info_list:
-                link = markup.to_html(ss_info.page_url, ss_info.thumbnail_url)
-                file.write("<table class=box-shadow "
-                           "style='position:relative;'>\n"
-                           "<tr><td rowspan=2>{}</td>".format(link))
+            parts.append("</tr>\n"
+                         "<tr><td>\n")
 
-                if ss_info.timecode:
-                    file.write("<td><font style='font-weight:bold; "
-                               "position: absolute; right:0px;\'>{0}</font>"
-                               "</td>".format(ss_info.timecode))
+            for name, link in zip(self.INPUT_BOX_NAMES, ss_links):
+                parts.append(self._generate_input_box(name, link))
 
-                file.write("</tr>\n"
-                           "<tr><td>\n")
+            parts.append("</td></tr>\n"
+                         "</table>\n")
 
-                for name, func in (('HTML', markup.to_html),
-                                   ('BBcode', markup.to_bbcode),
-                                   ('URL', markup.to_url)):
-                    link = func(ss_info.page_url, ss_info.thumbnail_url)
+        return ''.join(parts)
 
-                    file.write(self._generate_input_box(name, link))
+    def _write_section(self, section):
+        """write `section` over the footer and the footer after it, so that
+           readers of the file always see a complete page"""
+        self._file.seek(self._footer_at)
+        self._file.write(section.encode('utf-8'))
+        self._footer_at = self._file.tell()
 
-                file.write("</td></tr>\n"
-                           "</table>\n")
+        self._file.write(self.FOOTER.encode('utf-8'))
+        self._file.truncate()
+        self._file.flush()
 
-        file.write("\n</body>\n</html>\n")
+    def open(self):
+        """start streaming: write the page without sections"""
+        self._file = open(self.path, 'wb')
+        self._file.write(self.HEADER.encode('utf-8'))
+        self._footer_at = self._file.tell()
 
-        file.close()
+        self._file.write(self.FOOTER.encode('utf-8'))
+        self._file.flush()
+
+    @timed('html', size=lambda result, args: file_size(args[0].path))
+    def append_section(self, input_file):
+        """add the section of `input_file` and write it out right away,
+           starting to stream if needed"""
+        self.add_section(input_file)
+
+        if self._file is None:
+            self.open()
+        self._write_section(self._render_section(*self.sections[-1]))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @timed('html', size=lambda result, args: file_size(args[0].path))
+    def write(self):
+        """write the page with all sections at once"""
+        self.close()
+
+        with open(self.path, 'wb') as file:
+            file.write(self.HEADER.encode('utf-8'))
+            for filename, info_list in self.sections:
+                file.write(self._render_section(filename,
+                                                info_list).encode('utf-8'))
+            file.write(self.FOOTER.encode('utf-8'))
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import socket
+import uuid
+import hashlib
+import threading
+
+from .cache import file_key
+from .file_type import InputFile, ScreenshotFile
+from .utils import warn
+
+# seconds after which the job of a worker which stopped renewing its lease,
+# e.g. because its node died, is handed out again
+DEFAULT_LEASE = 600.0
+# times a job is handed out before it is given up on
+MAX_ATTEMPTS = 3
+
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+
+def _write_json(path, data):
+    """write `data` to `path` at once, readers on other nodes never see a
+       partial file"""
+    tmp_path = '{}.{}.{}.tmp'.format(path, socket.gethostname(), os.getpid())
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, separators=(',', ':'))
+    getattr(os, 'replace', os.rename)(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class JobQueue(object):
+    """Queue of input files to process, kept in a directory shared by the
+       nodes working on it, one json file per job.
+
+    A job moves between the sub-dirs named after the STATES with atomic
+    renames, so only one worker can claim it. A claimed job is leased: its
+    file's mtime is renewed by heartbeat() while the job is worked on, and
+    reclaim() puts jobs whose lease is older than `lease` seconds back,
+    which counts as an attempt. The file of a claim is named after the job
+    and a token of its own, so a worker whose lease expired can neither
+    renew nor finish the claim of the worker the job went to next.
+    Input file paths have to be the same on all nodes."""
+
+    def __init__(self, directory, lease=DEFAULT_LEASE):
+        self.directory = directory
+        self.lease = lease
+        self.worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+        for state in STATES:
+            path = os.path.join(directory, state)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def _path(self, state, job_id):
+        return os.path.join(self.directory, state, job_id + '.json')
+
+    def _ids(self, state):
+        """the job ids in `state`, those of claims with their token"""
+        return sorted(name[:-5] for name in
+                      os.listdir(os.path.join(self.directory, state))
+                      if name.endswith('.json'))
+
+    def _claim_path(self, job):
+        return self._path('claimed', '{}.{}'.format(job['id'], job['claim']))
+
+    @staticmethod
+    def job_id(path):
+        return hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+
+    def enqueue(self, path, order=None, name_prefix=''):
+        """add a job for the input file `path`, returns False if it is
+           queued, being worked on or done already and has not changed.
+           `name_prefix` is that of InputFile"""
+        job_id = self.job_id(path)
+        key = file_key(path)
+
+        if os.path.isfile(self._path('pending', job_id)) or any(
+                claim.partition('.')[0] == job_id
+                for claim in self._ids('claimed')):
+            return False
+
+        done = _read_json(self._path('done', job_id))
+        if done is not None and done.get('key') == key:
+            return False
+
+        for state in ('done', 'failed'):
+            try:
+                os.remove(self._path(state, job_id))
+            except OSError:
+                pass
+
+        _write_json(self._path('pending', job_id),
+                    {'id': job_id, 'path': os.path.abspath(path), 'key': key,
+                     'order': order if order is not None else time.time(),
+                     'name_prefix': name_prefix,
+                     'attempts': 0})
+        return True
+
+    def claim(self):
+        """move a pending job to this worker, returns it or None if there is
+           none, after reclaiming the jobs of dead workers"""
+        for reclaimed in (False, True):
+            if reclaimed and not self.reclaim():
+                break
+
+            for job_id in self._ids('pending'):
+                pending = self._path('pending', job_id)
+                token = uuid.uuid4().hex
+                claimed = self._path('claimed', job_id + '.' + token)
+                try:
+                    # the lease starts before the job shows up as claimed
+                    os.utime(pending, None)
+                    os.rename(pending, claimed)
+                except OSError:  # claimed by another worker meanwhile
+                    continue
+
+                job = _read_json(claimed)
+                if job is None:
+                    os.remove(claimed)
+                    continue
+
+                job.update(worker=self.worker, claim=token)
+                return job
+
+        return None
+
+    def heartbeat(self, jobs):
+        """renew the leases of `jobs`"""
+        for job in jobs:
+            try:
+                os.utime(self._claim_path(job), None)
+            except OSError:  # reclaimed, the result will be dropped
+                pass
+
+    def reclaim(self):
+        """put claimed jobs with an expired lease back, or give up on them
+           after MAX_ATTEMPTS, returns how many"""
+        count = 0
+        expired = time.time() - self.lease
+        for claim in self._ids('claimed'):
+            claimed = self._path('claimed', claim)
+            # taken over under a name of its own, so that the worker of the
+            # claim can no longer renew or finish it
+            expiring = claimed + '.expired'
+            try:
+                if os.path.getmtime(claimed) >= expired:
+                    continue
+                os.rename(claimed, expiring)
+            except OSError:  # finished or reclaimed meanwhile
+                continue
+
+            job = _read_json(expiring)
+            if job is not None:
+                self._retry(job, "the lease of the job expired")
+                count += 1
+            os.remove(expiring)
+
+        return count
+
+    def complete(self, job, input_file):
+        """record the screenshots of the job's input file as its result,
+           returns False if the claim was lost, e.g. as its lease expired"""
+        if not self._remove_claim(job):
+            return False
+
+        result = dict(job, worker=self.worker, finished=time.time(),
+                      screenshots=[{'path': ss.path,
+                                    'timecode': ss.timecode.seconds,
+                                    'page_url': ss.page_url,
+                                    'thumbnail_url': ss.thumbnail_url,
+                                    'host': ss.host}
+                                   for ss in input_file.screenshots])
+
+        result.pop('claim')
+        _write_json(self._path('done', job['id']), result)
+        return True
+
+    def release(self, job, error):
+        """hand a job which failed back, or give up on it after
+           MAX_ATTEMPTS, returns False if the claim was lost"""
+        if not self._remove_claim(job):
+            return False
+
+        self._retry(job, error)
+        return True
+
+    def _retry(self, job, error):
+        job = dict(job, attempts=job.get('attempts', 0) + 1,
+                   error=str(error))
+        job.pop('worker', None)
+        job.pop('claim', None)
+
+        state = 'failed' if job['attempts'] >= MAX_ATTEMPTS else 'pending'
+        _write_json(self._path(state, job['id']), job)
+
+    def _remove_claim(self, job):
+        """end the claim of `job`, returns False if it is not this
+           worker's any more"""
+        try:
+            os.remove(self._claim_path(job))
+        except OSError:
+            return False
+
+        return True
+
+    def counts(self):
+        return dict((state, len(self._ids(state))) for state in STATES)
+
+    def jobs(self, state):
+        """the jobs in `state`, in the order they were enqueued"""
+        jobs = [_read_json(self._path(state, job_id))
+                for job_id in self._ids(state)]
+
+        return sorted((job for job in jobs if job is not None),
+                      key=lambda job: (job.get('order', 0), job['path']))
+
+    def results(self):
+        """an InputFile with the ScreenshotFiles uploaded for each done job,
+           in the order they were enqueued"""
+        input_files = []
+        for job in self.jobs('done'):
+            input_file = InputFile(job['path'])
+            for screenshot in job['screenshots']:
+                ss = ScreenshotFile(screenshot['path'],
+                                    screenshot['timecode'], input_file)
+                ss.page_url = screenshot['page_url']
+                ss.thumbnail_url = screenshot['thumbnail_url']
+                ss.host = screenshot.get('host')
+                input_file.screenshots.append(ss)
+
+            input_files.append(input_file)
+
+        return input_files
+
+
+class Claims(object):
+    """Iterates over the InputFiles of the jobs this worker claims from a
+       JobQueue, e.g. as input files of a Pipeline. No more than `limit`
+       jobs are claimed and not yet finished at any time, so that the jobs
+       are spread over all workers; their leases are renewed until close().
+       Iteration ends once no job is left to claim, or on stop()."""
+
+    def __init__(self, queue, limit):
+        self.queue = queue
+
+        self._jobs = {}  # id(input_file) -> job, claimed and not finished
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, limit))
+        self._stopped = threading.Event()
+        self._closed = threading.Event()
+
+        self._heartbeat = threading.Thread(target=self._renew)
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+
+    def _renew(self):
+        while not self._closed.wait(self.queue.lease / 4.0):
+            with self._lock:
+                jobs = list(self._jobs.values())
+            self.queue.heartbeat(jobs)
+
+    def __iter__(self):
+        while not self._stopped.is_set():
+            if not self._slots.acquire(timeout=0.5):
+                continue
+
+            job = self.queue.claim()
+            if job is None:
+                self._slots.release()
+                break
+
+            input_file = InputFile(job['path'], job.get('name_prefix', ''))
+            if not input_file.exists():
+                self.queue.release(job, "'{}' does not exist on {}".format(
+                    job['path'], self.queue.worker))
+                self._slots.release()
+                continue
+
+            with self._lock:
+                self._jobs[id(input_file)] = job
+
+            yield input_file
+
+    def finish(self, input_file, error=None):
+        """complete the job of `input_file`, or release it if `error`"""
+        with self._lock:
+            job = self._jobs.pop(id(input_file), None)
+        if job is None:
+            return
+
+        if error is None and not input_file.screenshots:
+            error = "no screenshots were taken"
+
+        if error is None:
+            finished = self.queue.complete(job, input_file)
+        else:
+            finished = self.queue.release(job, error)
+        self._slots.release()
+
+        if not finished:
+            warn("The lease on '{}' expired, it was handed to another "
+                 "worker".format(input_file.path))
+
+    def release_all(self, error):
+        """release the jobs of the files not finished, when the worker is
+           interrupted"""
+        with self._lock:
+            jobs, self._jobs = list(self._jobs.values()), {}
+
+        for job in jobs:
+            self.queue.release(job, error)
+            self._slots.release()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def stop(self):
+        self._stopped.set()
+
+    def close(self):
+        self._stopped.set()
+        self._closed.set()
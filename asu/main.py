@@ -2,7 +2,9 @@ from __future__ import print_function
 
 import os
 import sys
-import webbrowser
+import time
+import signal
+import threading
 
 from optparse import OptionParser
 try:
@@ -12,15 +14,40 @@ except ImportError:
 
 from . import (__version__, VALID_INPUT_FILE_EXTENSIONS,
                DEFAULT_SCREENSHOT_AMOUNT)
-from . import utils, upload, markup
-from .file_type import InputFile, HtmlFile
-from .utils import fatal, warn, ffmpeg_exe
+from . import utils, upload, markup, scoring, metrics
+from .cache import (FileCache, ProbeCache, UploadLedger, HostLimits,
+                    DEFAULT_PROBE_CACHE_SIZE, DEFAULT_UPLOAD_LEDGER_SIZE)
+from .extract import (Extractor, MODES as EXTRACT_MODES, DEFAULT_MODE,
+                      DEFAULT_MEMORY_BUDGET, default_jobs)
+from .discover import Discovery
+from .file_type import InputFile, HtmlFile, SPREADS, DEFAULT_SPREAD
+from .scenes import DEFAULT_THRESHOLD as DEFAULT_SCENE_THRESHOLD
+from .manifest import Manifest
+from .optimize import (Optimizer, FORMATS as IMAGE_FORMATS,
+                       DEFAULT_QUALITY as DEFAULT_IMAGE_QUALITY)
+from .pipeline import Pipeline, DEFAULT_BACKLOG
+from .utils import fatal, warn, info, ffmpeg_exe
+from .watch import Watcher, DEFAULT_INTERVAL, DEFAULT_SETTLE
+from .jobqueue import JobQueue, Claims, DEFAULT_LEASE
 
 SHOW_OPTIONS = ('url', 'html', 'bbcode')
 
+USAGES = {None: '%prog [options] [<input> ...]',
+          'watch': '%prog watch [options] <dir> [<dir> ...]',
+          'enqueue': '%prog enqueue -q <queue> [options] <input> '
+                     '[<input> ...]',
+          'worker': '%prog worker -q <queue> [options]',
+          'merge': '%prog merge -q <queue> [options]'}
+# the modes working on a job queue shared by several nodes, see jobqueue
+QUEUE_MODES = ('enqueue', 'worker', 'merge')
 
-def build_parser():
-    usage = 'usage: %prog [options] [<input> ...]'
+
+def build_parser(mode=None):
+    if mode is not None:
+        usage = 'usage: ' + USAGES[mode]
+    else:
+        usage = 'usage: ' + '\n       '.join(
+            USAGES[m] for m in (None, 'watch') + QUEUE_MODES)
     version = '%prog {}'.format(__version__)
     parser = OptionParser(usage=usage, version=version)
     parser.add_option('-o', '--output-dir',
@@ -43,12 +70,19 @@ def build_parser():
     parser.add_option('-i', '--image-host',
                       action='store', type='string', dest='image_host',
                       help="image host to which the screenshots will be "
-                           "uploaded. Default host: " + upload.default_host)
+                           "uploaded, or several comma separated ones to "
+                           "route each upload to the fastest of and fail "
+                           "over between. Default host: " +
+                           upload.default_host)
     parser.add_option('--hosts',
                       action='store_true', dest='hosts', default=False,
                       help="show information on host plugins: available "
                            "hosts, max screenshots per input file and "
                            "thumbnail sizes for each host")
+    parser.add_option('--limits',
+                      action='store_true', dest='limits', default=False,
+                      help="show the upload limits learned for each host: "
+                           "requests in flight and per second")
     parser.add_option('-l', '--login',
                       action='store', type='string', dest='login',
                       help='username password combo used for logging into '
@@ -71,16 +105,162 @@ def build_parser():
                       action='store', type='string', dest='ffmpeg_arg',
                       help="extra arguments passed to ffmpeg when taking "
                            "screenshots")
+    parser.add_option('-j', '--jobs',
+                      action='store', type='int', dest='jobs', default=0,
+                      help="amount of ffmpeg processes run at the same time "
+                           "when taking screenshots, default: number of CPUs")
+    parser.add_option('--upload-jobs',
+                      action='store', type='int', dest='upload_jobs',
+                      default=0,
+                      help="max amount of concurrent upload requests, the "
+                           "requests are adapted to each image host below "
+                           "it. Default: " + str(upload.MAX_IN_FLIGHT_LIMIT))
+    parser.add_option('--force-upload',
+                      action='store_true', dest='force_upload', default=False,
+                      help="upload screenshots even if identical files were "
+                           "uploaded to the image host before")
+    parser.add_option('--resume',
+                      action='store_true', dest='resume', default=False,
+                      help="continue an interrupted run with the same output "
+                           "dir, skipping screenshots and uploads it "
+                           "finished")
+    parser.add_option('--extract-mode',
+                      action='store', type='choice', dest='extract_mode',
+                      choices=EXTRACT_MODES,
+                      help="'frame' runs one ffmpeg process per screenshot, "
+                           "'single' takes all screenshots of an input file "
+                           "with one ffmpeg process. Default: " +
+                           DEFAULT_MODE)
+    parser.add_option('--in-memory',
+                      action='store_true', dest='in_memory', default=False,
+                      help="pass screenshots from ffmpeg to the image host "
+                           "in memory, without writing them to the output "
+                           "dir")
+    parser.add_option('--memory-budget',
+                      action='store', type='int', dest='memory_budget',
+                      default=0,
+                      help="max MiB of screenshots kept in memory with "
+                           "'--in-memory', default: " +
+                           str(DEFAULT_MEMORY_BUDGET // (1024 * 1024)))
+    parser.add_option('--spread',
+                      action='store', type='choice', dest='spread',
+                      choices=SPREADS,
+                      help="'even' spaces screenshots evenly, 'scenes' "
+                           "takes them at scene cuts, which are detected "
+                           "once per input file. Default: " + DEFAULT_SPREAD)
+    parser.add_option('--image-format',
+                      action='store', type='choice', dest='image_format',
+                      choices=IMAGE_FORMATS,
+                      help="re-encode screenshots before uploading them: "
+                           "'png' compresses them better without loss, "
+                           "'jpeg' and 'webp' convert them")
+    parser.add_option('--image-quality',
+                      action='store', type='int', dest='image_quality',
+                      help="quality, 1 to 100, of screenshots converted to "
+                           "'jpeg' or 'webp', default: " +
+                           str(DEFAULT_IMAGE_QUALITY))
+    parser.add_option('--select',
+                      action='store_true', dest='select', default=False,
+                      help="move screenshots away from black, blank and "
+                           "near duplicate frames, requires NumPy")
+    parser.add_option('--no-probe-cache',
+                      action='store_true', dest='no_probe_cache',
+                      default=False,
+                      help="do not read or write the on-disk cache of input "
+                           "file durations and stream information")
+    parser.add_option('--metrics',
+                      action='store', type='choice', dest='metrics',
+                      choices=metrics.FORMATS,
+                      help="record the calls, time and bytes of every stage "
+                           "and write them as 'json' or in the Prometheus "
+                           "text format, 'prom'")
+    parser.add_option('--metrics-file',
+                      action='store', type='string', dest='metrics_file',
+                      help="file the metrics are written to, default: "
+                           "asu-metrics.<format> in the output dir")
+    parser.add_option('-v', '--verbose',
+                      action='store_true', dest='verbose', default=False,
+                      help="print timing information to stderr")
+    parser.add_option('-r', '--recursive',
+                      action='store_true', dest='recursive', default=False,
+                      help="also search sub-directories of input dirs for "
+                           "input files")
+    parser.add_option('--max-depth',
+                      action='store', type='int', dest='max_depth',
+                      help="max levels of sub-directories searched with "
+                           "'--recursive', default: no limit")
+    parser.add_option('--include',
+                      action='append', type='string', dest='include',
+                      help="only use files of input dirs matching this glob "
+                           "pattern, may be given multiple times")
+    parser.add_option('--exclude',
+                      action='append', type='string', dest='exclude',
+                      help="skip files and sub-directories of input dirs "
+                           "matching this glob pattern, may be given "
+                           "multiple times")
     parser.add_option('-c', '--config',
                       action='store', type='string', dest='config',
                       help="location of config file")
+
+    if mode == 'watch':
+        parser.add_option('--interval',
+                          action='store', type='float', dest='interval',
+                          help="seconds between scans of the watched dirs, "
+                               "default: " + str(DEFAULT_INTERVAL))
+        parser.add_option('--settle',
+                          action='store', type='float', dest='settle',
+                          help="seconds the size of a new file has to stay "
+                               "the same before it is processed, default: " +
+                               str(DEFAULT_SETTLE))
+
+    if mode in QUEUE_MODES:
+        parser.add_option('-q', '--queue',
+                          action='store', type='string', dest='queue_dir',
+                          help="job queue dir, shared by all nodes")
+    if mode == 'worker':
+        parser.add_option('--lease',
+                          action='store', type='float', dest='lease',
+                          help="seconds after which the jobs of a worker "
+                               "that stopped are handed out again, "
+                               "default: " + str(DEFAULT_LEASE))
     return parser
 
 
+def show_limits(cfg):
+    limits = HostLimits(os.path.join(
+        os.path.expanduser(cfg['cache_dir'] or utils.cache_dir()),
+        'limits.json'))
+
+    for host_name in limits.hosts():
+        learned = limits.lookup(host_name)
+        if learned is None:
+            print("'{}': expired".format(host_name))
+            continue
+
+        if learned['rate'] is None:
+            rate = "no rate limit"
+        else:
+            rate = "{:.1f} requests per second".format(learned['rate'])
+        print("'{}': {:.1f} requests in flight, {}; learned {}".format(
+            host_name, learned['in_flight'], rate,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(learned['time']))))
+
+
+def split_hosts(value):
+    """the names in a comma separated list of hosts, without repeats"""
+    names = []
+    for name in (value or upload.default_host).split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+
+    return names or [upload.default_host]
+
+
 def parse_options(cfg, options, args):
     if options['hosts']:
         for host_name in upload.hosts:
-            host = upload.get_host(host_name)
+            host = upload.host_info(host_name)
 
             fmt = "'{}': max {} screenshots; thumbnail sizes: {}"
             sizes = ", ".join((str(size) for size in host.thumbnail_sizes))
@@ -88,6 +268,10 @@ def parse_options(cfg, options, args):
 
         sys.exit(0)
 
+    if options['limits']:
+        show_limits(cfg)
+        sys.exit(0)
+
     if options['output_dir'] is not None:
         path = options['output_dir']
         cfg['output_dir'] = os.path.realpath(os.path.normpath(path))
@@ -109,9 +293,12 @@ def parse_options(cfg, options, args):
         else:
             fatal("Commandline argument used with '--login' is invalid")
 
-    cfg['image_host'] = (options['image_host'] or cfg['image_host'] or
-                         upload.default_host)
-    host = upload.get_host(cfg['image_host'])
+    host_names = split_hosts(options['image_host'] or cfg['image_host'])
+    for host_name in host_names:
+        if host_name not in upload.hosts:
+            fatal("Image host '{}' does not exist".format(host_name))
+    cfg['image_host'], cfg['fallback_hosts'] = host_names[0], host_names[1:]
+    host = upload.host_info(cfg['image_host'])
 
     if host.quantity.min <= options['screenshot_amount'] <= host.quantity.max:
         cfg['screenshot_amount'] = options['screenshot_amount']
@@ -141,16 +328,380 @@ def parse_options(cfg, options, args):
     if options['ffmpeg_arg'] is not None:
         cfg['ffmpeg_arg'] = options['ffmpeg_arg']
 
+    if options['jobs'] < 0:
+        fatal("Commandline argument used with '--jobs' cannot be negative")
+    elif options['jobs'] != 0:
+        cfg['jobs'] = options['jobs']
+
+    if options['upload_jobs'] < 0:
+        fatal("Commandline argument used with '--upload-jobs' cannot be "
+              "negative")
+    elif options['upload_jobs'] != 0:
+        cfg['upload_jobs'] = options['upload_jobs']
+
+    if options['force_upload'] is True:
+        cfg['force_upload'] = True
+
+    if options['in_memory'] is True:
+        cfg['in_memory'] = True
+
+    if options['memory_budget'] < 0:
+        fatal("Commandline argument used with '--memory-budget' cannot be "
+              "negative")
+    elif options['memory_budget'] != 0:
+        cfg['memory_budget'] = options['memory_budget']
+
+    if options['resume'] is True:
+        cfg['resume'] = True
+
+    if options['extract_mode'] is not None:
+        cfg['extract_mode'] = options['extract_mode']
+    elif cfg['extract_mode'] not in EXTRACT_MODES:
+        fatal("Config option 'extract_mode' is invalid")
+
+    if cfg['in_memory']:
+        if cfg['no_upload']:
+            fatal("Commandline argument '--in-memory' cannot be used with "
+                  "'--no-upload'")
+        if cfg['extract_mode'] == 'single':
+            fatal("Commandline argument '--in-memory' cannot be used with "
+                  "the 'single' extraction mode")
+
+    if options['recursive'] is True:
+        cfg['recursive'] = True
+
+    if options['max_depth'] is not None:
+        if options['max_depth'] < 0:
+            fatal("Commandline argument used with '--max-depth' cannot be "
+                  "negative")
+        cfg['max_depth'] = options['max_depth']
+
+    for key in ('include', 'exclude'):
+        if isinstance(cfg[key], str):  # comma separated in the config file
+            cfg[key] = [p.strip() for p in cfg[key].split(',') if p.strip()]
+        if options[key]:
+            cfg[key] = options[key]
+
+    for key, cfg_key in (('interval', 'watch_interval'),
+                         ('settle', 'watch_settle')):
+        if options.get(key) is not None:
+            if options[key] < 0:
+                fatal("Commandline argument used with '--{}' cannot be "
+                      "negative".format(key))
+            cfg[cfg_key] = options[key]
+
+    if options.get('queue_dir') is not None:
+        cfg['queue_dir'] = options['queue_dir']
+
+    if options.get('lease') is not None:
+        cfg['queue_lease'] = options['lease']
+    if cfg['queue_lease'] <= 0:
+        fatal("The job queue lease has to be more than 0 seconds")
+
+    if options['spread'] is not None:
+        cfg['spread'] = options['spread']
+    elif cfg['spread'] not in SPREADS:
+        fatal("Config option 'spread' is invalid")
+
+    if not 0 < cfg['scene_threshold'] < 1:
+        fatal("Config option 'scene_threshold' has to be between 0 and 1")
+
+    if options['image_format'] is not None:
+        cfg['image_format'] = options['image_format']
+    elif cfg['image_format'] not in IMAGE_FORMATS + (None, ''):
+        fatal("Config option 'image_format' is invalid")
+
+    if options['image_quality'] is not None:
+        cfg['image_quality'] = options['image_quality']
+    if not 1 <= cfg['image_quality'] <= 100:
+        fatal("Image quality has to be between 1 and 100")
+
+    if options['select'] is True:
+        cfg['select'] = True
+
+    if cfg['select'] and not scoring.available():
+        fatal("Selecting screenshots by their content requires NumPy, "
+              "which is not installed")
+
+    if options['no_probe_cache'] is True:
+        cfg['probe_cache'] = False
+
+    if options['metrics'] is not None:
+        cfg['metrics'] = options['metrics']
+    elif cfg['metrics'] not in metrics.FORMATS + (None, ''):
+        fatal("Config option 'metrics' is invalid")
+
+    if options['metrics_file'] is not None:
+        cfg['metrics_file'] = options['metrics_file']
+    if cfg['metrics'] and not cfg['metrics_file']:
+        cfg['metrics_file'] = os.path.join(
+            cfg['output_dir'], 'asu-metrics.{}'.format(cfg['metrics']))
+
+    if options['verbose'] is not False:
+        cfg['verbose'] = options['verbose']
+
     return cfg
 
 
+def save_cache(cache, name):
+    if cache is not None:
+        try:
+            cache.save()
+        except (IOError, OSError) as e:
+            warn("Failed to write {}: {}".format(name, e))
+
+
+def write_metrics(cfg):
+    if cfg['metrics']:
+        try:
+            metrics.write(cfg['metrics_file'], cfg['metrics'])
+        except (IOError, OSError) as e:
+            warn("Failed to write metrics: {}".format(e))
+
+
+def shutdown(cfg, manifest, uploader=None, ledger=None):
+    if uploader is not None:
+        uploader.close()
+        save_cache(uploader.limits, "upload limits")
+        if cfg['verbose']:
+            report_limits(uploader.hosts)
+            if len(uploader.hosts) > 1:
+                report_routing(uploader.router)
+    manifest.close()
+    save_cache(InputFile.probe_cache, "probe cache")
+    save_cache(ledger, "upload ledger")
+    write_metrics(cfg)
+
+
+def report_optimized(input_file, optimizer):
+    stats = [optimizer.stats[ss.path] for ss in input_file.screenshots
+             if ss.path in optimizer.stats]
+    if stats:
+        original, uploaded, seconds = [sum(s) for s in zip(*stats)]
+        info("{}: {} of {} bytes saved re-encoding screenshots in "
+             "{:.2f}s".format(input_file.filename, original - uploaded,
+                              original, seconds))
+
+
+def report_limits(hosts):
+    for host in hosts:
+        throttle = host.throttle
+        if not throttle.responses:
+            continue
+
+        rate = ("{:.1f}/s".format(throttle.rate) if throttle.rate is not None
+                else "no rate limit")
+        info("{}: up to {} requests in flight, {}, throttled {} "
+             "times".format(host.name, int(throttle.limit), rate,
+                            throttle.throttled))
+
+
+def upload_progress():
+    """a BaseHost.progress callback telling the bytes of every file sent
+       and how fast, once all of them are"""
+    started = {}
+
+    def progress(filename, sent, size):
+        start = started.setdefault(filename, time.time())
+        if sent < size:
+            return
+
+        del started[filename]  # sent again on a retry
+        seconds = time.time() - start
+        info("Sent '{}': {} bytes in {:.2f}s, {:.0f} KiB/s".format(
+            filename, size, seconds, size / 1024 / max(seconds, 0.001)))
+
+    return progress
+
+
+def report_routing(router):
+    for host in router.hosts:
+        stats = router.stats[host.name]
+        if stats.requests == 0:
+            continue
+        if stats.latency is None:
+            latency = 'no upload worked'
+        else:
+            latency = '{:.2f}s per file'.format(stats.latency)
+        info("{}: {} requests, {}, {:.0%} recent errors".format(
+            host.name, stats.requests, latency, stats.error_rate))
+
+
+def report_extract_time(input_file):
+    if input_file.extract_time is not None:
+        info("{}: {} screenshots in {:.2f}s".format(
+            input_file.filename, len(input_file.screenshots),
+            input_file.extract_time))
+
+
+def watch(cfg, watcher, extractor, pipeline, manifest):
+    """process the files appearing in the watched dirs until SIGINT or
+       SIGTERM is received. The first signal lets the files in progress
+       finish, a second one quits right away"""
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        if stopping.is_set():
+            raise KeyboardInterrupt
+        info("Finishing the files in progress, signal again to quit")
+        stopping.set()
+        watcher.stop()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    markup_func = {'url': markup.to_url,
+                   'html': markup.to_html,
+                   'bbcode': markup.to_bbcode}[cfg['show'] or 'url']
+
+    while not stopping.is_set():
+        if pipeline is None:
+            done = (input_file for input_file, _, remaining in
+                    extractor.iter_run(watcher, cfg['screenshot_amount'],
+                                       cfg['output_dir'])
+                    if remaining == 0)
+        else:
+            done = pipeline.run(watcher, cfg['screenshot_amount'],
+                                cfg['output_dir'])
+
+        try:
+            for input_file in done:
+                if input_file.error is not None or \
+                        not input_file.screenshots:
+                    warn("Skipping '{}' until it changes: {}".format(
+                        input_file.path, input_file.error or
+                        "no screenshots were taken"))
+                    watcher.failed(input_file)
+                    continue
+
+                manifest.add_done(input_file)
+                write_metrics(cfg)  # kept current for scrapers
+
+                if cfg['verbose']:
+                    report_extract_time(input_file)
+                    if pipeline is not None and pipeline.uploader.optimizer:
+                        report_optimized(input_file,
+                                         pipeline.uploader.optimizer)
+
+                print(input_file.path)
+                if pipeline is None:
+                    for ss in input_file.screenshots:
+                        print(ss.path)
+                else:
+                    print(' '.join(markup_func(ss.page_url, ss.thumbnail_url)
+                                   for ss in input_file.screenshots
+                                   if ss.page_url is not None))
+                print()
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            break
+        except Exception as e:  # keep watching, unfinished files are retried
+            if stopping.is_set():
+                raise
+            warn("Processing failed, restarting: {}".format(e))
+
+            watcher.reset()
+            time.sleep(watcher.interval)
+
+
+def enqueue(cfg, queue, args):
+    """add a job for each input file to the queue, those queued or done
+       already are skipped"""
+    discovery = Discovery(args, recursive=cfg['recursive'],
+                          max_depth=cfg['max_depth'],
+                          include=cfg['include'], exclude=cfg['exclude'])
+
+    # jobs are merged in the order they were enqueued in
+    start = time.time()
+    added, skipped = 0, 0
+    for index, input_file in enumerate(discovery):
+        if queue.enqueue(input_file.path, order=[start, index],
+                         name_prefix=input_file.name_prefix):
+            added += 1
+        else:
+            skipped += 1
+
+    if added + skipped == 0:
+        fatal("Nothing to do; no input files found")
+
+    print("{} jobs added, {} queued or done already".format(added, skipped))
+
+
+def work(cfg, claims, pipeline, manifest):
+    """process the jobs claimed from the queue until none is left or SIGINT
+       or SIGTERM is received. The first signal lets the files in progress
+       finish, a second one quits right away"""
+    def stop(signum, frame):
+        if claims.stopped:
+            raise KeyboardInterrupt
+        info("Finishing the files in progress, signal again to quit")
+        claims.stop()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        for input_file in pipeline.run(claims, cfg['screenshot_amount'],
+                                       cfg['output_dir']):
+            # only the job of a failed file is handed back, other workers
+            # may do better
+            claims.finish(input_file, input_file.error)
+            write_metrics(cfg)
+            if input_file.error is not None:
+                warn("Failed to process '{}': {}".format(input_file.path,
+                                                         input_file.error))
+                continue
+
+            manifest.add_done(input_file)
+
+            if cfg['verbose']:
+                report_extract_time(input_file)
+                if pipeline.uploader.optimizer is not None:
+                    report_optimized(input_file, pipeline.uploader.optimizer)
+
+            print(input_file.path)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        claims.release_all("the worker was interrupted")
+        raise
+
+
+def merge(cfg, queue):
+    """write the html file of the done jobs"""
+    counts = queue.counts()
+    for state in ('pending', 'claimed'):
+        if counts[state]:
+            warn("{} jobs are {}, the html file is incomplete".format(
+                counts[state], state))
+    for job in queue.jobs('failed'):
+        warn("Gave up on '{}': {}".format(job['path'], job.get('error')))
+
+    input_files = queue.results()
+    if len(input_files) == 0:
+        fatal("Nothing to do; no jobs are done")
+
+    html_file = HtmlFile(os.path.join(cfg['output_dir'], "out.html"))
+    for input_file in input_files:
+        html_file.add_section(input_file)
+    html_file.write()
+
+    show(cfg, html_file, input_files)
+
+
 def main(arguments=None):
     arguments = arguments or sys.argv[1:]
 
+    mode = None
+    if arguments[:1] and arguments[0] in ('watch',) + QUEUE_MODES:
+        mode, arguments = arguments[0], arguments[1:]
+    watch_mode = mode == 'watch'
+
     cfg = {'ffmpeg_command': ffmpeg_exe(),
            'output_dir': None,
            'no_upload': False,
            'image_host': None,
+           'fallback_hosts': [],
+           'host_logins': {},
            'browser': False,
            'screenshot_amount': DEFAULT_SCREENSHOT_AMOUNT,
            'thumbnail_size': None,
@@ -158,9 +709,40 @@ def main(arguments=None):
            'show': None,
            'frame_accurate': False,
            'ffmpeg_arg': None,
+           'jobs': 0,
+           'upload_jobs': 0,
+           'backlog': DEFAULT_BACKLOG,
+           'extract_mode': DEFAULT_MODE,
+           'verbose': False,
+           'probe_cache': True,
+           'probe_cache_size': DEFAULT_PROBE_CACHE_SIZE,
+           'probe_fingerprint': False,
+           'upload_ledger': True,
+           'upload_ledger_size': DEFAULT_UPLOAD_LEDGER_SIZE,
+           'force_upload': False,
+           'resume': False,
+           'recursive': False,
+           'max_depth': None,
+           'include': [],
+           'exclude': [],
+           'in_memory': False,
+           'select': False,
+           'image_format': None,
+           'image_quality': DEFAULT_IMAGE_QUALITY,
+           'image_max_size': 0,
+           'spread': DEFAULT_SPREAD,
+           'scene_threshold': DEFAULT_SCENE_THRESHOLD,
+           'memory_budget': DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+           'cache_dir': None,
+           'metrics': None,
+           'metrics_file': None,
+           'watch_interval': DEFAULT_INTERVAL,
+           'watch_settle': DEFAULT_SETTLE,
+           'queue_dir': None,
+           'queue_lease': DEFAULT_LEASE,
            'delete_screenshots': False}
 
-    options, args = build_parser().parse_args()
+    options, args = build_parser(mode).parse_args(arguments)
 
     if options.config:
         cfgfiles = [options.config]
@@ -182,88 +764,271 @@ def main(arguments=None):
         for key, val_type in (('no_upload', 'getboolean'),
                               ('browser', 'getboolean'),
                               ('frame_accurate', 'getboolean'),
+                              ('verbose', 'getboolean'),
+                              ('probe_cache', 'getboolean'),
+                              ('probe_fingerprint', 'getboolean'),
+                              ('probe_cache_size', 'getint'),
+                              ('upload_ledger', 'getboolean'),
+                              ('upload_ledger_size', 'getint'),
+                              ('in_memory', 'getboolean'),
+                              ('select', 'getboolean'),
+                              ('scene_threshold', 'getfloat'),
+                              ('image_quality', 'getint'),
+                              ('image_max_size', 'getint'),
+                              ('recursive', 'getboolean'),
+                              ('max_depth', 'getint'),
+                              ('memory_budget', 'getint'),
+                              ('watch_interval', 'getfloat'),
+                              ('watch_settle', 'getfloat'),
+                              ('queue_lease', 'getfloat'),
+                              ('jobs', 'getint'),
+                              ('upload_jobs', 'getint'),
+                              ('backlog', 'getint'),
                               ('screenshot_amount', 'getint'),
                               ('thumbnail_size', 'getint')):
 
             if config.has_option('asu', key):
                 cfg[key] = getattr(config, val_type)('asu', key)
 
+        # image options of the image host's own section, e.g. [imagebam]
+        host_names = split_hosts(options.image_host or cfg['image_host'])
+        host_name = host_names[0]
+        for key, val_type in (('image_format', 'get'),
+                              ('image_quality', 'getint'),
+                              ('image_max_size', 'getint')):
+            if config.has_option(host_name, key):
+                cfg[key] = getattr(config, val_type)(host_name, key)
+
+        # hosts failed over to log in with the login of their section
+        for host_name in host_names[1:]:
+            if config.has_option(host_name, 'login'):
+                cfg['host_logins'][host_name] = config.get(host_name,
+                                                           'login')
+
+    cache_dir = os.path.expanduser(cfg['cache_dir'] or utils.cache_dir())
+    upload.set_cache_dir(cache_dir)
+
     parse_options(cfg, options.__dict__, args)
 
-    version = utils.ffmpeg_version(cfg['ffmpeg_command'])
-    if version is False:
-        fatal("Failed to retrieve version number from ffmpeg")
-    elif version is None:
-        warn("ffmpeg does not look compatible, errors may occur")
+    if cfg['metrics']:
+        metrics.enable()
+
+    queue = None
+    if mode in QUEUE_MODES:
+        if not cfg['queue_dir']:
+            fatal("No job queue dir given, see '--queue'")
+        try:
+            queue = JobQueue(os.path.expanduser(cfg['queue_dir']),
+                             lease=cfg['queue_lease'])
+        except (IOError, OSError) as e:
+            fatal("Failed to open job queue: {}".format(e))
+
+    if mode == 'merge':
+        if args:
+            fatal("Merge takes no arguments, only '--queue'")
+        merge(cfg, queue)
+        sys.exit(0)
+
+    # spawning ffmpeg is slower than the rest of the startup
+    if mode != 'enqueue':
+        version_cache = FileCache(os.path.join(cache_dir, 'ffmpeg.json'))
+        version = utils.ffmpeg_version(cfg['ffmpeg_command'], version_cache)
+        save_cache(version_cache, "ffmpeg version cache")
+        if version is False:
+            fatal("Failed to retrieve version number from ffmpeg")
+        elif version is None:
+            warn("ffmpeg does not look compatible, errors may occur")
+
+    if mode == 'worker' and args:
+        fatal("Workers take no arguments, their jobs are in the queue")
 
-    input_files = []
     for arg in args:
-        if os.path.isdir(arg):
-            # for now just use single level depth
-            for f in os.listdir(arg):
-                path = os.path.join(arg, f)
-                if not os.path.isfile(path):
-                    continue
+        if watch_mode and not os.path.isdir(arg):
+            fatal("Watch argument '{}' is not a directory".format(arg))
+        elif os.path.isdir(arg):
+            continue
 
-                input_file = InputFile(path)
-                if (input_file.exists() and (input_file.ext.lower() in
-                                             VALID_INPUT_FILE_EXTENSIONS)):
-                    input_files.append(input_file)
-            # should an error be returned if no files were added?
-        else:
-            input_file = InputFile(arg)
-            if (input_file.exists() and (input_file.ext.lower() in
+        input_file = InputFile(arg)
+        if not (input_file.exists() and (input_file.ext.lower() in
                                          VALID_INPUT_FILE_EXTENSIONS)):
-                input_files.append(input_file)
-            else:
-                fatal("Input file argument '{}' is not a valid input "
-                      "file".format(arg))
+            fatal("Input file argument '{}' is not a valid input "
+                  "file".format(arg))
 
-    if len(input_files) == 0:
+    if len(args) == 0 and mode != 'worker':
+        if watch_mode:
+            fatal("Nothing to do; no directories to watch specified")
         fatal("Nothing to do; no input files specified")
 
-    for input_file in input_files:
-        input_file.make_screenshots(cfg['screenshot_amount'],
-                                    output_dir=cfg['output_dir'],
-                                    ffmpeg=cfg['ffmpeg_command'],
-                                    frame_accurate=cfg['frame_accurate'],
-                                    extra_args=cfg['ffmpeg_arg'])
+    if mode == 'enqueue':
+        enqueue(cfg, queue, args)
+        sys.exit(0)
+
+    if mode == 'worker' and cfg['no_upload']:
+        fatal("Workers upload the screenshots they take, '--no-upload' "
+              "cannot be used")
+
+    if cfg['probe_cache']:
+        InputFile.probe_cache = ProbeCache(
+            os.path.join(cache_dir, 'probe.json'),
+            max_entries=cfg['probe_cache_size'],
+            use_fingerprint=cfg['probe_fingerprint'])
+
+    # a watching process keeps track of the files it finished in the
+    # manifest, a restarted one skips them. So does a worker, should it get
+    # a job it did not finish before again
+    resume = cfg['resume'] or mode in ('watch', 'worker')
+    if cfg['no_upload']:
+        manifest = Manifest(cfg['output_dir'], resume=resume)
+    else:
+        manifest = Manifest(cfg['output_dir'], resume=resume,
+                            host=cfg['image_host'],
+                            thumbnail_size=cfg['thumbnail_size'],
+                            fallback_hosts=cfg['fallback_hosts'])
+
+    if watch_mode:
+        input_files = Watcher(args, interval=cfg['watch_interval'],
+                              settle=cfg['watch_settle'],
+                              skip=manifest.is_done,
+                              recursive=cfg['recursive'],
+                              max_depth=cfg['max_depth'],
+                              include=cfg['include'], exclude=cfg['exclude'])
+    elif mode == 'worker':
+        # twice the files extracted in parallel are claimed at a time, the
+        # rest of the jobs is left to the other workers
+        input_files = Claims(queue, 2 * (cfg['jobs'] or default_jobs()))
+    else:
+        # directories are walked while the first files are already processed
+        discovery = Discovery(args, recursive=cfg['recursive'],
+                              max_depth=cfg['max_depth'],
+                              include=cfg['include'], exclude=cfg['exclude'])
+        input_files = discovery.found
+
+    extractor = Extractor(jobs=cfg['jobs'], ffmpeg=cfg['ffmpeg_command'],
+                          frame_accurate=cfg['frame_accurate'],
+                          extra_args=cfg['ffmpeg_arg'],
+                          mode=cfg['extract_mode'], manifest=manifest,
+                          in_memory=cfg['in_memory'],
+                          memory_budget=cfg['memory_budget'] * 1024 * 1024,
+                          select=cfg['select'], spread=cfg['spread'],
+                          scene_threshold=cfg['scene_threshold'])
+
+    uploader, ledger, pipeline = None, None, None
+    if not cfg['no_upload']:
+        image_hosts = []
+        for host_name in [cfg['image_host']] + cfg['fallback_hosts']:
+            if host_name == cfg['image_host']:
+                login = cfg['login']
+            else:
+                login = cfg['host_logins'].get(host_name)
+
+            if login:
+                username, _, password = login.partition(':')
+            else:
+                username, password = None, None
+
+            # the thumbnails of all hosts are about the same size
+            Host = upload.get_host(host_name)
+            image_hosts.append(Host(
+                username=username, password=password,
+                thumbnail_size=Host.nearest_thumbnail_size(
+                    cfg['thumbnail_size'])))
+            if cfg['verbose']:
+                image_hosts[-1].progress = upload_progress()
+
+        if cfg['upload_ledger']:
+            ledger = UploadLedger(os.path.join(cache_dir, 'uploads.json'),
+                                  max_entries=cfg['upload_ledger_size'])
+
+        optimizer = None
+        if cfg['image_format']:
+            optimizer = Optimizer(cfg['image_format'], cfg['image_quality'],
+                                  cfg['image_max_size'] * 1024,
+                                  ffmpeg=cfg['ffmpeg_command'])
+
+        uploader = upload.Uploader(image_hosts[0], jobs=cfg['upload_jobs'],
+                                   ledger=ledger, force=cfg['force_upload'],
+                                   optimizer=optimizer,
+                                   fallbacks=image_hosts[1:],
+                                   limits=HostLimits(os.path.join(
+                                       cache_dir, 'limits.json')))
+        pipeline = Pipeline(extractor, uploader, backlog=cfg['backlog'],
+                            delete_screenshots=cfg['delete_screenshots'],
+                            manifest=manifest)
+
+    if watch_mode:
+        try:
+            watch(cfg, input_files, extractor, pipeline, manifest)
+        finally:
+            shutdown(cfg, manifest, uploader, ledger)
+
+        sys.exit(0)
+
+    if mode == 'worker':
+        try:
+            work(cfg, input_files, pipeline, manifest)
+        finally:
+            input_files.close()
+            shutdown(cfg, manifest, uploader, ledger)
+
+        sys.exit(0)
 
     if cfg['no_upload']:
+        try:
+            extractor.run(discovery, cfg['screenshot_amount'],
+                          cfg['output_dir'])
+        finally:
+            shutdown(cfg, manifest)
+
+        if len(input_files) == 0:
+            fatal("Nothing to do; no input files found")
+
+        if cfg['verbose']:
+            for input_file in input_files:
+                report_extract_time(input_file)
+
         for input_file in input_files:
+            if not input_file.screenshots:  # warned about already
+                continue
             for ss in input_file.screenshots:
                 print(ss.path)
             print()
 
         sys.exit(0)
 
-    if cfg['login']:
-        username, _, password = cfg['login'].partition(':')
-    else:
-        username, password = None, None
-
-    Host = upload.get_host(cfg['image_host'])
-    image_host = Host(username=username, password=password,
-                      thumbnail_size=cfg['thumbnail_size'])
-
+    # sections are added as files finish, so that an interrupted run still
+    # leaves a usable page
     html_file = HtmlFile(os.path.join(cfg['output_dir'], "out.html"))
+    done = []
+    try:
+        for input_file in pipeline.run(discovery, cfg['screenshot_amount'],
+                                       cfg['output_dir']):
+            if input_file.error is not None:
+                warn("Skipping '{}': {}".format(input_file.path,
+                                                input_file.error))
+                continue
+            html_file.append_section(input_file)
+            done.append(input_file)
 
-    for input_file in input_files:
-        uploads = image_host.upload([ss.path for ss in input_file.screenshots])
-
-        for ss, (_, page, thumb) in zip(input_file.screenshots, uploads):
-            ss.page_url = page
-            ss.thumbnail_url = thumb
+            if cfg['verbose']:
+                report_extract_time(input_file)
+                if uploader.optimizer is not None:
+                    report_optimized(input_file, uploader.optimizer)
+    finally:
+        html_file.close()
+        shutdown(cfg, manifest, uploader, ledger)
 
-        html_file.add_section(input_file)
+    if len(input_files) == 0:
+        fatal("Nothing to do; no input files found")
+    if len(done) == 0:
+        fatal("None of the input files could be processed")
 
-        if cfg['delete_screenshots']:
-            for ss_file in input_file.screenshots:
-                os.remove(ss_file.path)
+    show(cfg, html_file, done)
 
-    html_file.write()
 
+def show(cfg, html_file, input_files):
     if cfg['browser']:
+        import webbrowser
+
         webbrowser.open_new_tab(html_file.path)
 
     if cfg['show']:
@@ -272,9 +1037,8 @@ def main(arguments=None):
                        'bbcode': markup.to_bbcode}[cfg['show']]
 
         for input_file in input_files:
-            for ss in input_file.screenshots[:-1]:
-                print(markup_func(ss.page_url, ss.thumbnail_url), end=' ')
-            ss = input_file.screenshots[-1]
-            print(markup_func(ss.page_url, ss.thumbnail_url))
+            print(' '.join(markup_func(ss.page_url, ss.thumbnail_url)
+                           for ss in input_file.screenshots
+                           if ss.page_url is not None))
     else:
         print(html_file.path)
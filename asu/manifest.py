@@ -0,0 +1,170 @@
+import os
+import json
+import threading
+
+from .file_type import Timecode, ScreenshotFile
+from .probe import MediaInfo
+from .cache import file_key
+
+MANIFEST_FILENAME = 'asu-manifest.jsonl'
+
+
+class Manifest(object):
+    """Progress log of a run, kept in the output dir.
+
+    Every finished step (an input file probed, a screenshot taken, a
+    screenshot uploaded, an input file done) is appended as one json line
+    with a single write, so the log stays consistent if the process dies at
+    any point. With `resume` the existing log is read back and appended to,
+    otherwise it is started over."""
+
+    def __init__(self, output_dir, resume=False, host=None,
+                 thumbnail_size=None, fallback_hosts=()):
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.host = host
+        # uploads to any of the hosts the Uploader routes to are reused
+        self.hosts = (host,) + tuple(fallback_hosts)
+        self.thumbnail_size = thumbnail_size
+
+        # abspath -> {'key': ..., 'probe': {...}, 'screenshots': {path: {}}}
+        self._files = {}
+        self._lock = threading.Lock()
+
+        if resume:
+            self._load()
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not resume:
+            flags |= os.O_TRUNC
+        self._fd = os.open(self.path, flags, 0o644)
+
+    def _load(self):
+        try:
+            file = open(self.path, 'r')
+        except (IOError, OSError):
+            return
+
+        with file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # torn last line of a killed run
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        event = record.get('event')
+        entry = self._files.get(record.get('file'))
+
+        if event == 'probed':
+            self._files[record['file']] = {'key': record['key'],
+                                           'probe': record,
+                                           'screenshots': {}}
+        elif entry is None:
+            return
+        elif event == 'screenshot':
+            entry['screenshots'][record['path']] = {
+                'timecode': record['timecode']}
+        elif event == 'done':
+            entry['done'] = True
+        elif event == 'uploaded':
+            screenshot = entry['screenshots'].get(record['path'])
+            if screenshot is not None:
+                screenshot['upload'] = record
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self._lock:
+            self._apply(record)
+            os.write(self._fd, line.encode('utf-8'))
+
+    def _entry(self, input_file):
+        entry = self._files.get(os.path.abspath(input_file.path))
+        try:
+            if entry is not None and entry['key'] == file_key(
+                    input_file.path):
+                return entry
+        except (IOError, OSError):
+            pass
+
+        return None
+
+    def add_probed(self, input_file):
+        media_info = input_file.media_info
+        self._append({'event': 'probed',
+                      'file': os.path.abspath(input_file.path),
+                      'key': file_key(input_file.path),
+                      'duration': list(input_file.duration),
+                      'media': list(media_info) if media_info else None})
+
+    def add_screenshot(self, screenshot):
+        self._append({'event': 'screenshot',
+                      'file': os.path.abspath(screenshot.input_file.path),
+                      'path': screenshot.path,
+                      'timecode': screenshot.timecode.seconds})
+
+    def add_upload(self, screenshot):
+        self._append({'event': 'uploaded',
+                      'file': os.path.abspath(screenshot.input_file.path),
+                      'path': screenshot.path,
+                      'host': screenshot.host or self.host,
+                      'thumbnail_size': self.thumbnail_size,
+                      'page_url': screenshot.page_url,
+                      'thumbnail_url': screenshot.thumbnail_url})
+
+    def add_done(self, input_file):
+        self._append({'event': 'done',
+                      'file': os.path.abspath(input_file.path)})
+
+    def is_done(self, input_file):
+        """whether the input file, unchanged since, was finished before"""
+        entry = self._entry(input_file)
+
+        return entry is not None and entry.get('done', False)
+
+    def restore_probe(self, input_file):
+        """set the probe results of an earlier run on `input_file`, returns
+           False if there are none"""
+        entry = self._entry(input_file)
+        if entry is None:
+            return False
+
+        probe = entry['probe']
+        if probe.get('media'):
+            input_file.media_info = MediaInfo(*probe['media'])
+        input_file._probed = True
+        input_file.duration = Timecode(*probe['duration'])
+
+        return True
+
+    def restore_screenshot(self, input_file, timecode, path):
+        """return the ScreenshotFile an earlier run took at `timecode`, with
+           its urls if it was uploaded to the same host with the same
+           thumbnail size, or None if it needs to be taken again"""
+        entry = self._entry(input_file)
+        if entry is None:
+            return None
+
+        record = entry['screenshots'].get(path)
+        if record is None or record['timecode'] != timecode:
+            return None
+
+        upload = record.get('upload')
+        if (upload and upload['host'] in self.hosts and
+                upload['thumbnail_size'] == self.thumbnail_size):
+            screenshot = ScreenshotFile(path, timecode, input_file)
+            screenshot.page_url = upload['page_url']
+            screenshot.thumbnail_url = upload['thumbnail_url']
+            screenshot.host = upload['host']
+            return screenshot
+
+        if os.path.isfile(path):
+            return ScreenshotFile(path, timecode, input_file)
+
+        return None
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
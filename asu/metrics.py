@@ -0,0 +1,161 @@
+import os
+import time
+import json
+import threading
+from functools import wraps
+
+# 'json': one json document
+# 'prom': Prometheus text format, for the node exporter's textfile collector
+FORMATS = ('json', 'prom')
+
+enabled = False  # see enable(), instrumented calls only record if set
+
+_lock = threading.Lock()
+_stats = {}  # (stage, label) -> [count, seconds, bytes, errors]
+_statuses = {}  # (stage, label, status) -> count
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _statuses.clear()
+
+
+def record(stage, seconds, size=None, status=None, label=None, error=False):
+    key = (stage, label)
+
+    with _lock:
+        stat = _stats.get(key)
+        if stat is None:
+            stat = _stats[key] = [0, 0.0, 0, 0]
+
+        stat[0] += 1
+        stat[1] += seconds
+        if size:
+            stat[2] += size
+        if error:
+            stat[3] += 1
+
+        if status is not None:
+            key += (status,)
+            _statuses[key] = _statuses.get(key, 0) + 1
+
+
+def timed(stage, size=None, status=None, label=None):
+    """decorator recording the calls of a function under `stage` while
+       metrics are enabled, costs a single check otherwise.
+
+       `size(result, args)` returns the bytes handled by a call,
+       `status(result)` e.g. an exit code and `label(args)` a label to tell
+       apart calls of the same stage, like the command that was run"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            call_label = label(args) if label is not None else None
+
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                record(stage, time.time() - start, label=call_label,
+                       error=True)
+                raise
+            seconds = time.time() - start
+
+            try:
+                call_size = size(result, args) if size is not None else None
+            except (IOError, OSError):
+                call_size = None
+
+            record(stage, seconds, call_size,
+                   status(result) if status is not None else None,
+                   call_label)
+
+            return result
+        return wrapper
+    return decorator
+
+
+def file_size(f):
+    """size of a path or a file object, None if unknown"""
+    if f is None:
+        return None
+    if isinstance(f, str):
+        return os.path.getsize(f)
+    if hasattr(f, 'getbuffer'):
+        return len(f.getbuffer())
+
+    return None
+
+
+def snapshot():
+    """return the recorded metrics as a list of dicts"""
+    with _lock:
+        metrics = []
+        for (stage, label), (count, seconds, size, errors) in sorted(
+                _stats.items(), key=lambda item: (item[0][0],
+                                                  item[0][1] or '')):
+            statuses = dict((str(status), n) for (s, l, status), n in
+                            _statuses.items() if (s, l) == (stage, label))
+            metrics.append({'stage': stage, 'label': label, 'count': count,
+                            'seconds': seconds, 'bytes': size,
+                            'errors': errors, 'statuses': statuses})
+
+    return metrics
+
+
+def _prometheus(metrics):
+    lines = []
+    for name, field, help_text in (
+            ('asu_calls_total', 'count', 'calls of a stage'),
+            ('asu_seconds_total', 'seconds', 'seconds spent in a stage'),
+            ('asu_bytes_total', 'bytes', 'bytes handled by a stage'),
+            ('asu_errors_total', 'errors', 'calls of a stage that raised')):
+        lines += ['# HELP {} {}'.format(name, help_text),
+                  '# TYPE {} counter'.format(name)]
+        for metric in metrics:
+            lines.append('{}{{{}}} {}'.format(name, _labels(metric),
+                                              metric[field]))
+
+    lines += ['# HELP asu_status_total calls of a stage by exit status',
+              '# TYPE asu_status_total counter']
+    for metric in metrics:
+        for status, count in sorted(metric['statuses'].items()):
+            lines.append('asu_status_total{{{},status="{}"}} {}'.format(
+                _labels(metric), status, count))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(metric):
+    labels = 'stage="{}"'.format(metric['stage'])
+    if metric['label'] is not None:
+        labels += ',label="{}"'.format(
+            metric['label'].replace('\\', '\\\\').replace('"', '\\"'))
+
+    return labels
+
+
+def write(path, fmt='json'):
+    """write the recorded metrics to `path`, replacing the file at once so
+       that readers never see a partial file"""
+    metrics = snapshot()
+
+    if fmt == 'prom':
+        data = _prometheus(metrics)
+    else:
+        data = json.dumps({'time': time.time(), 'metrics': metrics},
+                          indent=2) + '\n'
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as file:
+        file.write(data)
+    getattr(os, 'replace', os.rename)(tmp_path, path)
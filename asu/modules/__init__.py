@@ -1,47 +1,75 @@
 import os
 import sys
-import imp
-import inspect
+import importlib
+import threading
+from importlib.machinery import PathFinder
+from importlib.util import module_from_spec
 from types import ModuleType
 
 
+class LazyModule(ModuleType):
+    """stands in for a module until one of its attributes is used, so that
+       e.g. the HTTP stack is only imported once something is uploaded"""
+
+    def __init__(self, importer, name):
+        super(LazyModule, self).__init__(name)
+        self._importer = importer
+
+    def __getattr__(self, attr):
+        return getattr(self._importer._load(self.__name__), attr)
+
+
 class SpecialImporter(ModuleType):
     def __init__(self, module):
         self.__module__ = module
         self.__name__ = module.__name__
 
-        module_filename = inspect.getfile(inspect.currentframe())
-        self._path = os.path.dirname(os.path.abspath(module_filename))
+        self._path = os.path.dirname(os.path.abspath(__file__))
+        self._loaded = {}
+        self._lock = threading.Lock()  # first uses may race in threads
+
+    def _bundled(self, name):
+        path = os.path.join(self._path, name)
 
-        self._modules = []
-        for entry in os.listdir(self._path):
-            path = os.path.join(self._path, entry)
+        return (os.path.isfile(path + '.py') or
+                os.path.isfile(os.path.join(path, '__init__.py')))
 
-            if os.path.isfile(path) and entry.endswith(".py"):
-                if entry != "__init__.py":
-                    self._modules.append(entry[:-3])
-            elif os.path.isdir(path) and "__init__.py" in os.listdir(path):
-                self._modules.append(entry)
+    def _load(self, name):
+        module = self._loaded.get(name)
+        if module is not None:
+            return module
+
+        with self._lock:
+            if name not in self._loaded:
+                self._loaded[name] = self._import(name)
+
+        return self._loaded[name]
 
     def _import(self, name):
-        info = imp.find_module(name, [self._path])
-        try:
-            module = imp.load_module(name, *info)
-        finally:
-            if info[0]:
-                info[0].close()
+        if self._bundled(name):  # shipped copies are top-level modules
+            module = sys.modules.get(name)
+            if module is None:
+                spec = PathFinder.find_spec(name, [self._path])
+                module = module_from_spec(spec)
+                sys.modules[name] = module
+                try:
+                    spec.loader.exec_module(module)
+                except BaseException:
+                    del sys.modules[name]
+                    raise
+        else:
+            module = importlib.import_module(name)
 
-        setattr(self.__module__, name, module)
+        return module
 
     def __getattr__(self, attr):
         if getattr(self.__module__, attr, None):
             return getattr(self.__module__, attr)
 
-        if not attr.startswith('_') and attr in self._modules:
-            self._import(attr)
-        else:
-            module = imp.load_module(attr, *imp.find_module(attr))
-            setattr(self.__module__, attr, module)
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+
+        setattr(self.__module__, attr, LazyModule(self, attr))
 
         return getattr(self.__module__, attr)
 
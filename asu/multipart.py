@@ -0,0 +1,161 @@
+import os
+import io
+import mmap
+import time
+import uuid
+import mimetypes
+
+from . import metrics
+
+CHUNK_SIZE = 256 * 1024
+
+
+def _quote(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _size(f):
+    """bytes left to read of a path or file object"""
+    if isinstance(f, str):
+        return os.path.getsize(f)
+
+    position = f.tell()
+    f.seek(0, io.SEEK_END)
+    size = f.tell() - position
+    f.seek(position)
+
+    return size
+
+
+def _mapped_chunks(mapped, chunk_size):
+    """chunks of a memory mapped file as memoryviews, which are sent without
+       being copied into Python objects first"""
+    view = memoryview(mapped)
+    try:
+        for offset in range(0, len(mapped), chunk_size):
+            yield view[offset:offset + chunk_size]
+    finally:
+        try:
+            view.release()
+            mapped.close()
+        except BufferError:  # a chunk is still in use, freed with it
+            pass
+
+
+def _read_chunks(file, chunk_size):
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class MultipartEncoder(object):
+    """A multipart/form-data request body, streamed instead of built in
+       memory: iterating over it yields the body in chunks of at most
+       `chunk_size` bytes, reading files only as they are sent. len() is
+       the Content-Length, known before anything is read.
+
+    `fields` are (name, value) pairs, `files` (name, (filename, file))
+    pairs as for requests, each file a path or a file object, which is
+    sent from its current position. Paths are opened, and memory mapped,
+    one at a time while streaming. `progress` is called with the filename,
+    the bytes of it sent and its size after every chunk. Every file sent is
+    recorded as a 'send' stage in metrics, see metrics.timed().
+
+    The body can be iterated over again, e.g. to retry a request."""
+
+    def __init__(self, fields=(), files=(), boundary=None,
+                 chunk_size=CHUNK_SIZE, progress=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+        # (bytes before, (filename, file, size) or None, bytes after)
+        self._parts = []
+        for name, value in fields:
+            if value is None:
+                continue
+            if not isinstance(value, bytes):
+                value = str(value).encode('utf-8')
+
+            self._parts.append((self._header(name) + value + b'\r\n', None,
+                                b''))
+
+        self._starts = {}  # file object -> position to start sending at
+        for name, (filename, f) in files:
+            content_type = (mimetypes.guess_type(filename)[0] or
+                            'application/octet-stream')
+            if not isinstance(f, str):
+                self._starts[id(f)] = f.tell()
+
+            self._parts.append((self._header(name, filename, content_type),
+                                (filename, f, _size(f)), b'\r\n'))
+
+        self._end = '--{}--\r\n'.format(self.boundary).encode('utf-8')
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def _header(self, name, filename=None, content_type=None):
+        header = '--{}\r\nContent-Disposition: form-data; name="{}"'.format(
+            self.boundary, _quote(name))
+        if filename is not None:
+            header += '; filename="{}"\r\nContent-Type: {}'.format(
+                _quote(filename), content_type)
+
+        return (header + '\r\n\r\n').encode('utf-8')
+
+    def __len__(self):
+        length = len(self._end)
+        for before, f, after in self._parts:
+            length += len(before) + len(after)
+            if f is not None:
+                length += f[2]
+
+        return length
+
+    def _file_chunks(self, f):
+        if not isinstance(f, str):
+            f.seek(self._starts[id(f)])
+            return _read_chunks(f, self.chunk_size), None
+
+        file = open(f, 'rb')
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # e.g. empty, read it instead
+            return _read_chunks(file, self.chunk_size), file
+
+        return _mapped_chunks(mapped, self.chunk_size), file
+
+    def _send_file(self, filename, f, size):
+        chunks, opened = self._file_chunks(f)
+
+        sent = 0
+        start = time.time()
+        try:
+            for chunk in chunks:
+                yield chunk
+
+                sent += len(chunk)
+                if self.progress is not None:
+                    self.progress(filename, sent, size)
+        finally:
+            chunks.close()
+            if opened is not None:
+                opened.close()
+
+        if metrics.enabled:
+            metrics.record('send', time.time() - start, sent)
+
+    def __iter__(self):
+        for before, f, after in self._parts:
+            yield before
+            if f is not None:
+                for chunk in self._send_file(*f):
+                    yield chunk
+            if after:
+                yield after
+
+        yield self._end
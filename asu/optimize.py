@@ -0,0 +1,190 @@
+import io
+import os
+import time
+import threading
+import subprocess
+import multiprocessing
+
+# optional, ffmpeg is used instead. Imported by pillow() when the first
+# image is encoded, in the worker processes
+Image = None
+
+from . import DEFAULT_FFMPEG_COMMAND
+
+# 'png': lossless recompression
+# 'jpeg', 'webp': lossy re-encoding at the given quality
+FORMATS = ('png', 'jpeg', 'webp')
+EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+DEFAULT_QUALITY = 90  # 1 to 100
+# lowest quality used to get below a size budget
+MIN_QUALITY = 60
+QUALITY_STEP = 5
+
+
+def pillow():
+    """return True if Pillow is installed"""
+    global Image
+
+    if Image is None:
+        try:
+            from PIL import Image
+        except ImportError:
+            return False
+
+    return True
+
+
+def _encode_pillow(data, fmt, quality):
+    image = Image.open(io.BytesIO(data))
+    output = io.BytesIO()
+
+    if fmt == 'png':
+        image.save(output, 'PNG', optimize=True)
+    elif fmt == 'jpeg':
+        # no chroma subsampling at high qualities, it blurs text and edges
+        image.convert('RGB').save(output, 'JPEG', quality=quality,
+                                  optimize=True, progressive=True,
+                                  subsampling=0 if quality >= 90 else 2)
+    else:
+        image.save(output, 'WEBP', quality=quality, method=6)
+
+    return output.getvalue()
+
+
+def _encode_ffmpeg(data, fmt, quality, ffmpeg):
+    if fmt == 'png':
+        codec_args = ['-c:v', 'png', '-pred', 'mixed', '-f', 'image2pipe']
+    elif fmt == 'jpeg':
+        qscale = int(round(2 + (100 - quality) * 29 / 99.0))
+        codec_args = ['-c:v', 'mjpeg', '-q:v', str(qscale),
+                      '-pix_fmt', 'yuvj444p', '-f', 'image2pipe']
+    else:
+        codec_args = ['-c:v', 'libwebp', '-quality', str(quality),
+                      '-f', 'webp']
+
+    proc = subprocess.Popen([ffmpeg, '-v', 'error', '-f', 'image2pipe',
+                             '-i', '-', '-frames:v', '1'] + codec_args + ['-'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    stdout, _ = proc.communicate(data)
+
+    return stdout if proc.returncode == 0 else None
+
+
+def encode(data, fmt, quality=DEFAULT_QUALITY, max_size=None, ffmpeg=None):
+    """re-encode the image `data` to `fmt`. Lossy formats are re-encoded at
+       lower qualities, down to MIN_QUALITY, while the result is larger than
+       `max_size` bytes. Uses Pillow if it is installed, ffmpeg otherwise.
+       Returns None if encoding failed"""
+    ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
+
+    while True:
+        try:
+            if pillow():
+                encoded = _encode_pillow(data, fmt, quality)
+            else:
+                encoded = _encode_ffmpeg(data, fmt, quality, ffmpeg)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if (encoded is None or fmt == 'png' or not max_size or
+                len(encoded) <= max_size or quality <= MIN_QUALITY):
+            return encoded
+
+        quality = max(MIN_QUALITY, quality - QUALITY_STEP)
+
+
+def _process(args):
+    """runs in a worker process: returns (encoded, seconds)"""
+    start = time.time()
+    encoded = encode(*args)
+
+    return encoded, time.time() - start
+
+
+class Optimizer(object):
+    """Re-encodes images before they are uploaded in a pool of `processes`
+       worker processes, to cut the bytes sent to the image host.
+
+    Images which could not be encoded, or would get larger, are passed on
+    as they are. The original files are never changed. The bytes saved and
+    the time spent are kept in `stats` for every image, by name."""
+
+    def __init__(self, fmt, quality=None, max_size=None, processes=None,
+                 ffmpeg=None):
+        if fmt not in FORMATS:
+            raise ValueError("unknown image format '{}'".format(fmt))
+
+        self.fmt = fmt
+        self.quality = quality or DEFAULT_QUALITY
+        self.max_size = max_size
+        self.processes = processes
+        self.ffmpeg = ffmpeg
+
+        self.stats = {}  # name -> (original bytes, bytes uploaded, seconds)
+
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read(image):
+        if isinstance(image, str):
+            with open(image, 'rb') as file:
+                return image, file.read()
+
+        image.seek(0)
+        data = image.read()
+        image.seek(0)  # uploaded as it is if re-encoding does not pay off
+
+        return image.name, data
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # started from an upload thread: forking a process with
+                # threads may copy locks held by other threads, deadlocking
+                # the workers, spawned ones start clean
+                context = multiprocessing.get_context('spawn')
+                self._pool = context.Pool(self.processes)
+
+            return self._pool
+
+    def process(self, images):
+        """re-encode `images` (paths or named file objects), returns a list
+           of the file objects to be uploaded instead, in the same order"""
+        read = [self._read(image) for image in images]
+        names = [name for name, _ in read]
+        data = [d for _, d in read]
+
+        results = self._get_pool().map(
+            _process, [(d, self.fmt, self.quality, self.max_size, self.ffmpeg)
+                       for d in data])
+
+        processed = []
+        for image, name, original, (encoded, seconds) in zip(
+                images, names, data, results):
+            if encoded is None or len(encoded) >= len(original):
+                encoded = None
+
+            with self._lock:
+                self.stats[name] = (len(original),
+                                    len(encoded or original), seconds)
+
+            if encoded is None:
+                processed.append(image)
+                continue
+
+            output = io.BytesIO(encoded)
+            output.name = '{}.{}'.format(os.path.splitext(name)[0],
+                                         EXTENSIONS[self.fmt])
+            processed.append(output)
+
+        return processed
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import deque
+from functools import partial
+
+from . import AsuError, UploadError
+from .upload import Batcher
+from .utils import warn
+
+# max amount of screenshots taken, but not yet uploaded, at any time
+DEFAULT_BACKLOG = 40
+# seconds after which finished uploads are looked for while the extraction
+# is idle, e.g. while waiting for new files to appear
+TICK = 0.5
+
+
+class Pipeline(object):
+    """Streams screenshots from an Extractor to an Uploader.
+
+    The screenshots of an input file are queued for uploading as soon as all
+    of them have been taken, while the extraction of the following files
+    goes on. The screenshots of several files are packed into requests of up
+    to the host's quantity.max files, see upload.Batcher; requests which are
+    not full are sent whenever the extraction is idle or done. A semaphore
+    of `backlog` slots, bounding the screenshots that are on disk waiting
+    for their upload, throttles the extraction whenever the uploads fall
+    behind.
+
+    A file whose upload failed is yielded all the same, with the error as
+    its `error`, so that the others go on."""
+
+    def __init__(self, extractor, uploader, backlog=None,
+                 delete_screenshots=False, manifest=None):
+        self.extractor = extractor
+        self.uploader = uploader
+        self.backlog = backlog or DEFAULT_BACKLOG
+        self.delete_screenshots = delete_screenshots
+        self.manifest = manifest
+
+    def _uploaded(self, input_file, screenshots, slots, uploads):
+        try:
+            for ss, uploaded in zip(screenshots, uploads):
+                if uploaded is None:
+                    warn("No links were returned for '{}'".format(ss.path))
+                    continue
+
+                ss.page_url = uploaded.page_url
+                ss.thumbnail_url = uploaded.thumbnail_url
+                ss.host = uploaded.host
+
+                if self.manifest is not None:
+                    self.manifest.add_upload(ss)
+
+            for ss in screenshots:
+                if ss.data is not None:
+                    ss.free()
+                elif self.delete_screenshots:
+                    try:
+                        os.remove(ss.path)
+                    except OSError as e:
+                        warn("Failed to delete '{}': {}".format(ss.path, e))
+        finally:
+            self._release(input_file, slots)
+
+    @staticmethod
+    def _release(input_file, slots, error=None):
+        for ss in input_file.screenshots:
+            ss.free()
+            slots.release()
+
+    @staticmethod
+    def _finish(input_file, result):
+        try:
+            result.get()
+        except AsuError as e:
+            input_file.error = e
+        except Exception as e:  # e.g. of the HTTP stack
+            error = UploadError("Uploading '{}' failed: {}".format(
+                input_file.path, e))
+            error.__cause__ = e
+            input_file.error = error
+
+        return input_file
+
+    def run(self, input_files, amount, output_dir):
+        """take and upload the screenshots of all input files, yielding each
+           InputFile once its screenshots are uploaded. Files are yielded in
+           the order their extraction finished."""
+        slots = threading.BoundedSemaphore(max(self.backlog, amount))
+        pending = deque()
+        batcher = Batcher(self.uploader)
+
+        extracted = self.extractor.iter_run(input_files, amount, output_dir,
+                                            slots=slots, tick=TICK)
+        try:
+            for input_file, _, remaining in extracted:
+                if input_file is None:  # idle, e.g. waiting for free slots
+                    batcher.flush()
+                elif remaining == 0:
+                    # screenshots restored from the manifest may be uploaded
+                    # already
+                    screenshots = [ss for ss in input_file.screenshots
+                                   if ss.page_url is None]
+                    result = batcher.add(
+                        [ss.source for ss in screenshots],
+                        callback=partial(self._uploaded, input_file,
+                                         screenshots, slots),
+                        error_callback=partial(self._release, input_file,
+                                               slots))
+                    pending.append((input_file, result))
+
+                while pending and pending[0][1].ready():
+                    yield self._finish(*pending.popleft())
+        finally:
+            # stops the extraction right away if the caller gives up
+            extracted.close()
+
+        batcher.flush()
+        while pending:
+            yield self._finish(*pending.popleft())
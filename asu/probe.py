@@ -0,0 +1,131 @@
+import sys
+import json
+from collections import namedtuple
+
+from .utils import quote_path, run_command, ffprobe_exe
+
+# duration_ms: int; fps: float or None; width/height: int; codec: str;
+# keyframe_interval: largest keyframe distance seen, in seconds, or None;
+# stream_index: index of the default video stream within the container
+MediaInfo = namedtuple('MediaInfo', 'duration_ms, fps, width, height, codec, '
+                       'keyframe_interval, stream_index')
+
+# seconds read from the start of the file to estimate the keyframe interval
+KEYFRAME_WINDOW = 30
+
+
+def _rate(string):
+    try:
+        num, _, den = (string or '').partition('/')
+        rate = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+    return rate or None
+
+
+def _default_video_stream(streams):
+    streams = [s for s in streams if s.get('codec_type') == 'video' and
+               not s.get('disposition', {}).get('attached_pic')]
+
+    for stream in streams:
+        if stream.get('disposition', {}).get('default'):
+            return stream
+
+    return streams[0] if streams else None
+
+
+def _keyframe_interval(packets, stream_index):
+    keyframes = []
+    for packet in packets:
+        if (packet.get('stream_index') == stream_index and
+                'K' in packet.get('flags', '') and 'pts_time' in packet):
+            keyframes.append(float(packet['pts_time']))
+
+    keyframes.sort()
+    gaps = [b - a for a, b in zip(keyframes, keyframes[1:])]
+
+    return max(gaps) if gaps else None
+
+
+def parse(data):
+    """build a MediaInfo record from ffprobe's json output"""
+    stream = _default_video_stream(data.get('streams', ()))
+    if stream is None:
+        return None
+
+    duration = (data.get('format', {}).get('duration') or
+                stream.get('duration'))
+    try:
+        duration_ms = int(float(duration) * 1000)
+    except (TypeError, ValueError):
+        return None
+
+    fps = (_rate(stream.get('avg_frame_rate')) or
+           _rate(stream.get('r_frame_rate')))
+
+    return MediaInfo(duration_ms, fps, stream.get('width'),
+                     stream.get('height'), stream.get('codec_name'),
+                     _keyframe_interval(data.get('packets', ()),
+                                        stream['index']),
+                     stream['index'])
+
+
+def probe(path, ffprobe=None):
+    """run ffprobe once on `path`, returns a MediaInfo or None"""
+    ffprobe = ffprobe or ffprobe_exe()
+
+    if 'win32' in sys.platform:
+        path = quote_path(path)
+
+    try:
+        retcode, stdout, _ = run_command(
+            ffprobe, '-v', 'error', '-of', 'json',
+            '-show_format', '-show_streams', '-select_streams', 'v',
+            '-show_entries', 'packet=stream_index,pts_time,flags',
+            '-read_intervals', '%+{}'.format(KEYFRAME_WINDOW), path)
+    except OSError:  # ffprobe is not installed
+        return None
+
+    if retcode != 0:
+        return None
+
+    try:
+        return parse(json.loads(stdout.decode('utf-8')))
+    except ValueError:
+        return None
+
+
+def keyframes(path, ffprobe=None, stream_index=None):
+    """return the sorted times, in seconds from the start of the file, of
+       the keyframes of a video stream. Only the packet index is read, no
+       frame is decoded. Returns None if ffprobe failed"""
+    ffprobe = ffprobe or ffprobe_exe()
+
+    if 'win32' in sys.platform:
+        path = quote_path(path)
+
+    stream = str(stream_index) if stream_index is not None else 'v:0'
+    try:
+        retcode, stdout, _ = run_command(
+            ffprobe, '-v', 'error', '-of', 'csv', '-select_streams', stream,
+            '-show_entries', 'format=start_time:packet=pts_time,flags', path)
+    except OSError:
+        return None
+
+    if retcode != 0:
+        return None
+
+    start_time = 0.0
+    times = []
+    for line in stdout.decode('utf-8').splitlines():
+        fields = line.split(',')
+        try:
+            if fields[0] == 'packet' and 'K' in fields[2]:
+                times.append(float(fields[1]))
+            elif fields[0] == 'format':
+                start_time = float(fields[1])
+        except (IndexError, ValueError):  # N/A timestamps
+            continue
+
+    return sorted(round(t - start_time, 3) for t in times)
@@ -0,0 +1,83 @@
+import sys
+import subprocess
+
+from . import DEFAULT_FFMPEG_COMMAND
+from .scoring import re_frame_time
+from .utils import quote_path
+
+# minimal ffmpeg scene score, 0 to 1, of a frame starting a new scene
+DEFAULT_THRESHOLD = 0.3
+# width of the frames compared by the scene detection
+SCALE_WIDTH = 160
+
+
+def iter_cuts(path, ffmpeg=None, threshold=DEFAULT_THRESHOLD,
+              stream='0:v:0'):
+    """yield the times of the scene cuts of a video stream while ffmpeg is
+       still looking for them. Only keyframes are decoded, at low
+       resolution. `stream` is the ffmpeg -map argument of the stream.
+       Raises OSError if ffmpeg cannot be run or fails"""
+    ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
+
+    if 'win32' in sys.platform:
+        path = quote_path(path)
+
+    filters = "scale={}:-2,select='gt(scene,{})',showinfo".format(
+        SCALE_WIDTH, threshold)
+
+    proc = subprocess.Popen(
+        (ffmpeg, '-hide_banner', '-nostats', '-skip_frame', 'nokey',
+         '-i', path, '-map', stream, '-an', '-sn', '-vf', filters,
+         '-vsync', '0', '-f', 'null', '-'),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    try:
+        proc.stdout.close()
+        for line in iter(proc.stderr.readline, b''):
+            match = re_frame_time.search(line.decode('utf-8', 'replace'))
+            if match:
+                yield round(float(match.group(1)), 3)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stderr.close()
+        proc.wait()
+
+    # not reached if the caller stopped early
+    if proc.returncode != 0:
+        raise OSError("ffmpeg exited with status {}".format(proc.returncode))
+
+
+def detect(path, ffmpeg=None, threshold=DEFAULT_THRESHOLD, stream='0:v:0'):
+    """return the sorted times of the scene cuts, see iter_cuts(), or None
+       if ffmpeg failed"""
+    try:
+        return sorted(iter_cuts(path, ffmpeg, threshold, stream))
+    except OSError:
+        return None
+
+
+def pick(cuts, amount, duration):
+    """choose `amount` well separated timecodes from the scene `cuts`.
+
+    The duration is split into `amount` equal parts and the cut closest to
+    the middle of each part is taken, unless it is closer than half a part
+    to the previous timecode. Parts without such a cut get their middle, as
+    evenly spread screenshots would."""
+    part = duration / float(amount)
+
+    timecodes = []
+    for number in range(amount):
+        start = part * number
+        middle = start + part / 2
+
+        if timecodes:
+            start = max(start, timecodes[-1] + part / 2)
+
+        inside = [cut for cut in cuts if start <= cut < part * (number + 1)]
+        if inside:
+            timecodes.append(min(inside, key=lambda cut: abs(cut - middle)))
+        else:
+            timecodes.append(round(middle, 3))
+
+    return timecodes
@@ -0,0 +1,151 @@
+import re
+import sys
+
+# optional, only needed for content-aware selection. Imported by available()
+# as it takes longer to import than all of asu
+numpy = None
+
+from . import DEFAULT_FFMPEG_COMMAND
+from .utils import quote_path, run_command
+
+# size of the gray candidate frames that are scored, a multiple of HASH_SIZE
+FRAME_WIDTH = 64
+FRAME_HEIGHT = 32
+# the perceptual hash of a frame has HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+
+# part of the distance between two planned screenshots searched for a better
+# frame around each of them
+WINDOW = 0.5
+
+# frames with a mean luma outside of these bounds are black or white
+MIN_LUMA = 24
+MAX_LUMA = 232
+# frames with less luma deviation are blank, like fades and title cards
+MIN_DEVIATION = 12.0
+# frames whose hashes differ in less bits are near duplicates
+MIN_HASH_DISTANCE = 10
+
+# frame lines of the showinfo filter
+re_frame_time = re.compile(r'\bn:\s*\d+\s+pts:\s*\S+\s+'
+                           r'pts_time:\s*(-?[0-9.]+)')
+
+
+def available():
+    global numpy
+
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+
+    return True
+
+
+def windows(timecodes, duration):
+    """return the (start, end) time range searched around each timecode"""
+    half = duration / (len(timecodes) + 1) * WINDOW / 2
+
+    return [(max(0, t - half), min(duration, t + half)) for t in timecodes]
+
+
+def candidates(path, ranges, ffmpeg=None, stream='0:v:0'):
+    """decode the keyframes within the (start, end) time `ranges` in one
+       pass, scaled down to gray FRAME_WIDTH x FRAME_HEIGHT pixels. Returns a
+       (times, frames) tuple of numpy arrays, None if ffmpeg failed.
+       `stream` is the ffmpeg -map argument of the video stream"""
+    ffmpeg = ffmpeg or DEFAULT_FFMPEG_COMMAND
+
+    expr = '+'.join('between(t,{:.3f},{:.3f})'.format(start, end)
+                    for start, end in ranges)
+    filters = "select='{}',scale={}:{},format=gray,showinfo".format(
+        expr, FRAME_WIDTH, FRAME_HEIGHT)
+
+    if 'win32' in sys.platform:
+        path = quote_path(path)
+
+    try:
+        retcode, stdout, stderr = run_command(
+            ffmpeg, '-hide_banner', '-nostats', '-skip_frame', 'nokey',
+            '-i', path, '-map', stream, '-vf', filters, '-vsync', '0',
+            '-f', 'rawvideo', '-pix_fmt', 'gray', '-')
+    except OSError:
+        return None
+
+    if retcode != 0:
+        return None
+
+    times = [float(t) for t in
+             re_frame_time.findall(stderr.decode('utf-8', 'replace'))]
+
+    frame_size = FRAME_WIDTH * FRAME_HEIGHT
+    count = min(len(times), len(stdout) // frame_size)
+    frames = numpy.frombuffer(stdout, numpy.uint8, count * frame_size)
+
+    return (numpy.array(times[:count]),
+            frames.reshape(count, FRAME_HEIGHT, FRAME_WIDTH))
+
+
+def hashes(frames):
+    """average hashes of the frames, as (n, HASH_SIZE ** 2) bool arrays"""
+    n, height, width = frames.shape
+    blocks = frames.reshape(n, HASH_SIZE, height // HASH_SIZE,
+                            HASH_SIZE, width // HASH_SIZE).mean(axis=(2, 4))
+    blocks = blocks.reshape(n, -1)
+
+    return blocks > numpy.median(blocks, axis=1)[:, None]
+
+
+def pick(timecodes, ranges, times, frames):
+    """choose one candidate frame per timecode, returns their times. The
+       candidates within the range of a timecode are ranked usable (neither
+       black, white nor blank) first, then those not too similar to the
+       frames already chosen, then by detail and closeness to the timecode.
+       Timecodes without any candidates are kept"""
+    luma = frames.mean(axis=(1, 2))
+    deviation = frames.std(axis=(1, 2))
+    usable = ((luma >= MIN_LUMA) & (luma <= MAX_LUMA) &
+              (deviation >= MIN_DEVIATION))
+    frame_hashes = hashes(frames)
+
+    chosen = []
+    picked = []
+    for timecode, (start, end) in zip(timecodes, ranges):
+        index = numpy.flatnonzero((times >= start) & (times <= end))
+        if not len(index):
+            picked.append(timecode)
+            continue
+
+        if chosen:
+            differences = (frame_hashes[index][:, None, :] !=
+                           numpy.array(chosen)[None, :, :])
+            distinct = differences.sum(axis=2).min(axis=1) >= MIN_HASH_DISTANCE
+        else:
+            distinct = numpy.ones(len(index), bool)
+
+        # the last key sorts first
+        order = numpy.lexsort((numpy.abs(times[index] - timecode),
+                               -deviation[index], ~distinct, ~usable[index]))
+        best = index[order[0]]
+
+        chosen.append(frame_hashes[best])
+        picked.append(round(float(times[best]), 3))
+
+    return picked
+
+
+def select(path, timecodes, duration, ffmpeg=None, stream='0:v:0'):
+    """move each of the planned `timecodes` to the best looking keyframe
+       near it, see pick(). Returns the timecodes unchanged if the
+       candidates could not be decoded"""
+    if not available():
+        return timecodes
+
+    ranges = windows(timecodes, duration)
+
+    result = candidates(path, ranges, ffmpeg, stream)
+    if result is None or not len(result[0]):
+        return timecodes
+
+    return pick(timecodes, ranges, *result)
@@ -1,13 +1,56 @@
 import os
 import sys
-import imp
-import inspect
+import time
+import importlib
+import threading
 from types import ModuleType
-from collections import namedtuple
+
+from asu import UploadError
+from asu import metrics
+from asu.cache import FileCache
+from asu.metrics import timed, file_size
+from asu.utils import sha256_file, cache_dir
+from collections import namedtuple, deque
+from functools import partial
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 UploadRange = namedtuple('UploadRange', 'min, max')
 
-UploadedFile = namedtuple('UploadedFile', 'filename, page_url, thumbnail_url')
+# `host` is the name of the host that served the file, set by the Uploader
+UploadedFile = namedtuple('UploadedFile', 'filename, page_url, thumbnail_url, '
+                                          'host')
+UploadedFile.__new__.__defaults__ = (None,)
+
+# what the command line needs to know about a host, see host_info()
+HostInfo = namedtuple('HostInfo', 'name, quantity, thumbnail_sizes, '
+                                  'thumbnail_size')
+
+DEFAULT_MAX_IN_FLIGHT = 4
+# most requests in flight to one host a Throttle lets its limit grow to
+MAX_IN_FLIGHT_LIMIT = 16
+# least requests per second a Throttle lowers its rate to
+MIN_RATE = 0.2
+# responses slower than this many times the fastest recent one are a sign
+# of congestion, the limits stop growing
+LATENCY_TOLERANCE = 2.0
+# seconds of requests the rate is measured over when a host throttles
+RATE_WINDOW = 10.0
+# seconds to wait for a host to connect or to send the next bytes
+DEFAULT_TIMEOUT = 60.0
+
+# seconds a host which failed is passed over, doubled with every failure in a
+# row up to MAX_BACKOFF
+FAILURE_BACKOFF = 5.0
+MAX_BACKOFF = 300.0
+
+
+def _name(f):
+    return f if isinstance(f, str) else getattr(f, 'name', f)
 
 
 class BaseHost(object):
@@ -17,6 +60,8 @@ class BaseHost(object):
     # min/max amount of images to be uploaded at once
     quantity = UploadRange(-1, -1)
 
+    name = None  # name of the plugin, set by get_host()
+
     thumbnail_sizes = ()  # tuple containing all possible thumbnail sizes
     thumbnail_size = -1  # value from above tuple
 
@@ -25,13 +70,696 @@ class BaseHost(object):
 
     uploaded_files = []  # list containing UploadedFile tuples
 
+    # amount of upload requests sent to the host at the same time at first,
+    # adapted to the host's responses from there, see Throttle
+    max_in_flight = DEFAULT_MAX_IN_FLIGHT
+
+    # Throttle of the requests of the sessions, set by the Uploader
+    throttle = None
+
+    # called with the name of a file, the bytes of it sent and its size
+    # while files are uploaded, see multipart.MultipartEncoder
+    progress = None
+
+    # True if the host keeps per session upload state (e.g. a page listing
+    # the files of the session), so concurrent uploads need their own session
+    stateful_session = False
+
     def __init__(self, username=None, password=None, thumbnail_size=None):
         raise NotImplementedError
 
-    def upload(self, files):
+    @classmethod
+    def nearest_thumbnail_size(cls, size):
+        """the thumbnail size of the host closest to `size`, the default one
+           if `size` is None"""
+        if not size or not cls.thumbnail_sizes:
+            return cls.thumbnail_size
+
+        return min(cls.thumbnail_sizes, key=lambda s: (abs(s - size), s))
+
+    def login(self, session):
+        """log into the host, or otherwise prepare a new session for
+           uploading. Called once for each session"""
+        pass
+
+    @timed('login', label=lambda args: args[0].name)
+    def new_session(self, pool_size=1):
+        """return a new logged in requests session, keeping up to
+           `pool_size` connections alive"""
+        from asu.modules import requests
+
+        session = requests.session()
+
+        if self.throttle is not None:
+            adapter = throttled_adapter(self.throttle, pool_connections=1,
+                                        pool_maxsize=pool_size)
+        else:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        self.login(session)
+
+        return session
+
+    @staticmethod
+    def upload_name(f, count):
+        """name under which the `count`th file of an upload is sent, with
+           the extension of the file, png if it has none"""
+        name = f if isinstance(f, str) else getattr(f, 'name', None) or ''
+        ext = os.path.splitext(name)[1] or '.png'
+
+        return 'image{:02}{}'.format(count, ext)
+
+    def upload(self, files, session=None):
+        """upload `files` (paths or file objects) and return a list of
+           UploadedFile tuples in the same order. Uses `session` if given,
+           otherwise a new session is created and logged in"""
         raise NotImplementedError
 
 
+class Throttle(object):
+    """Adapts the requests sent to a host to how it copes with them (AIMD).
+
+    The requests in flight are bounded by `limit`, which grows by one per
+    `limit` healthy responses while it is reached, i.e. by about one per
+    round trip, and is halved when the host answers with 429 or a 5xx
+    status, or times out; a refused connection leaves it be. A response is
+    healthy if it took no more than LATENCY_TOLERANCE times the fastest
+    recent one. Requests per second are bounded by a token bucket of
+    `rate`, unlimited (None) until the host throttles for the first time;
+    then it is set to half the rate requests were sent at, and grows by one
+    per second while responses are healthy and requests wait for it.
+
+    Only one decrease happens per round trip, the responses of the requests
+    sent along with the one that was throttled do not count."""
+
+    def __init__(self, name, limit=DEFAULT_MAX_IN_FLIGHT, rate=None,
+                 max_limit=MAX_IN_FLIGHT_LIMIT):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.limit = min(max(1.0, float(limit)), self.max_limit)
+        self.rate = rate
+
+        self.throttled = 0  # responses that lowered the limits
+        self.responses = 0
+
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._tokens = 1.0
+        self._filled = time.time()
+        self._fastest = None
+        self._decreased = 0.0
+        self._sent = deque(maxlen=1000)
+        self._peak = 0  # most requests in flight since the limit grew
+        self._waited = False  # whether a request waited for the rate since
+
+    def _wait_for_token(self, now):
+        """take a token, returns the seconds until it is due"""
+        if self.rate is None:
+            return 0.0
+
+        self._tokens = min(max(1.0, self.rate), self._tokens +
+                           (now - self._filled) * self.rate)
+        self._filled = now
+        self._tokens -= 1
+
+        return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        with self._cond:
+            wait = self._wait_for_token(time.time())
+            self._waited = self._waited or wait > 0
+
+        if wait:  # not in flight yet, so that it does not count as such
+            time.sleep(wait)
+
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+            self._peak = max(self._peak, self._in_flight)
+
+            self._sent.append(time.time())
+
+    def _sent_rate(self, now):
+        sent = [t for t in self._sent if t > now - RATE_WINDOW]
+        if len(sent) < 2:
+            return MIN_RATE
+
+        return len(sent) / max(now - sent[0], 1.0)
+
+    def release(self, seconds, status=None, timed_out=False):
+        """account the response to a request, which took `seconds`"""
+        throttled = timed_out or (status is not None and
+                                  (status == 429 or status >= 500))
+
+        with self._cond:
+            self._in_flight -= 1
+            self.responses += 1
+            now = time.time()
+
+            if throttled:
+                if now - self._decreased > seconds:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.rate = max(MIN_RATE, self._sent_rate(now) / 2)
+                    self._tokens = min(self._tokens, 1.0)
+                    self._decreased = now
+                    self.throttled += 1
+            elif status is not None and status < 400:
+                if self._fastest is None or seconds < self._fastest:
+                    self._fastest = seconds
+                else:  # forget a fast response over time
+                    self._fastest += 0.01 * (seconds - self._fastest)
+
+                # limits which are not reached say nothing about the host
+                if seconds <= LATENCY_TOLERANCE * self._fastest:
+                    if self._peak >= int(self.limit):
+                        self.limit = min(self.max_limit,
+                                         self.limit + 1.0 / self.limit)
+                        self._peak = self._in_flight
+                    if self.rate is not None and self._waited:
+                        self.rate += 1.0 / self.rate
+                        self._waited = False
+
+            self._cond.notify_all()
+
+        if throttled and metrics.enabled:
+            metrics.record('throttle', seconds, status=status or 'timeout',
+                           label=self.name)
+
+
+_adapter_class = None
+
+
+def throttled_adapter(throttle, **kwargs):
+    """a requests HTTPAdapter sending each request through `throttle`, with
+       a DEFAULT_TIMEOUT unless the request has its own"""
+    from asu.modules import requests
+
+    global _adapter_class
+    if _adapter_class is None:
+        class ThrottledAdapter(requests.adapters.HTTPAdapter):
+            throttle = None
+
+            def send(self, request, **kwargs):
+                if kwargs.get('timeout') is None:
+                    kwargs['timeout'] = DEFAULT_TIMEOUT
+
+                self.throttle.acquire()
+                start = time.time()
+                try:
+                    response = super(ThrottledAdapter, self).send(request,
+                                                                  **kwargs)
+                except requests.exceptions.Timeout:
+                    self.throttle.release(time.time() - start,
+                                          timed_out=True)
+                    raise
+                except Exception:  # e.g. refused, which the Router handles
+                    self.throttle.release(time.time() - start)
+                    raise
+
+                self.throttle.release(time.time() - start,
+                                      response.status_code)
+                return response
+
+        _adapter_class = ThrottledAdapter
+
+    adapter = _adapter_class(**kwargs)
+    adapter.throttle = throttle
+
+    return adapter
+
+
+class SessionPool(object):
+    """Hands out logged in sessions of a host to concurrent uploads.
+
+    Hosts without per session state share a single session, and thereby its
+    keep-alive connections, so they are only logged into once. Stateful hosts
+    get up to `size` sessions, each of which is logged into once."""
+
+    def __init__(self, host, size):
+        self.host = host
+        self.size = size
+
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._shared = None
+
+    def acquire(self):
+        with self._lock:
+            if not self.host.stateful_session:
+                if self._shared is None:
+                    self._shared = self.host.new_session(self.size)
+                return self._shared
+
+            if self._idle.empty() and self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self.host.new_session()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._idle.get()
+
+    def release(self, session):
+        if self.host.stateful_session:
+            self._idle.put(session)
+
+
+class HostStats(object):
+    """Recent latency, per file uploaded, and error rate of the requests to
+       a host, as moving averages weighing the latest request by `weight`
+       so that they follow the host's state"""
+
+    weight = 0.3
+
+    def __init__(self):
+        self.latency = None  # seconds per file, None until a request worked
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0  # in a row
+        self.down_until = 0.0  # passed over until then after failing
+
+    def succeeded(self, seconds, count):
+        latency = seconds / max(1, count)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.weight * (latency - self.latency)
+
+        self.error_rate -= self.weight * self.error_rate
+        self.requests += 1
+        self.failures = 0
+        self.down_until = 0.0
+
+    def failed(self):
+        self.error_rate += self.weight * (1 - self.error_rate)
+        self.requests += 1
+        self.failures += 1
+        self.down_until = time.time() + min(
+            MAX_BACKOFF, FAILURE_BACKOFF * 2 ** (self.failures - 1))
+
+    def score(self):
+        """expected seconds per file, retries of failed requests included.
+           0 for hosts not measured yet, so that each host is tried"""
+        if self.latency is None:
+            return 0.0
+
+        return self.latency / max(0.05, 1 - self.error_rate)
+
+
+class Router(object):
+    """Picks the hosts an upload request is sent to out of several, fastest
+       first by their HostStats, then the others to fail over to.
+
+    Hosts which failed recently are tried last, hosts which cannot take as
+    few files as a request has (quantity.min) not at all. Requests with more
+    files than a host's quantity.max are split by the Uploader."""
+
+    def __init__(self, hosts):
+        self.hosts = list(hosts)
+        self.stats = dict((host.name, HostStats()) for host in self.hosts)
+
+        self._lock = threading.Lock()
+
+    def candidates(self, count):
+        """the hosts to try for a request of `count` files, in order"""
+        now = time.time()
+
+        with self._lock:
+            ranked = []
+            for index, host in enumerate(self.hosts):
+                if count < host.quantity.min:
+                    continue
+
+                stats = self.stats[host.name]
+                down = stats.down_until > now
+                ranked.append(((down, stats.down_until if down else
+                                stats.score(), index), host))
+
+        return [host for _, host in sorted(ranked, key=lambda r: r[0])]
+
+    def succeeded(self, host, seconds, count):
+        with self._lock:
+            self.stats[host.name].succeeded(seconds, count)
+
+    def failed(self, host):
+        with self._lock:
+            self.stats[host.name].failed()
+
+
+class Uploader(object):
+    """Uploads files through a host plugin with a bounded amount of requests
+       in flight, reusing logged in sessions for the whole run.
+
+    The requests to each host are adapted to how it copes with them, see
+    Throttle; `jobs` bounds the uploads in progress at the same time. With a
+    cache.HostLimits, the limits learned are kept from one run to the next.
+
+    With `fallbacks`, further hosts, each request goes to the host which
+    was the fastest lately and fails over to the others, see Router. The
+    thumbnail sizes of the hosts should match as closely as they can, see
+    BaseHost.nearest_thumbnail_size().
+
+    With a cache.UploadLedger, files whose content was uploaded to the same
+    host with the same thumbnail size before are not uploaded again, unless
+    `force` is set. With an optimize.Optimizer, the files which do get
+    uploaded are re-encoded first."""
+
+    def __init__(self, host, jobs=None, ledger=None, force=False,
+                 optimizer=None, fallbacks=(), limits=None):
+        self.host = host
+        self.hosts = [host] + list(fallbacks)
+        self.jobs = max(1, jobs or MAX_IN_FLIGHT_LIMIT)
+        self.ledger = ledger
+        self.force = force
+        self.optimizer = optimizer
+        self.limits = limits
+
+        for h in self.hosts:
+            learned = limits.lookup(h.name) if limits is not None else None
+            if learned is not None:
+                h.throttle = Throttle(h.name, learned['in_flight'],
+                                      learned['rate'], max_limit=self.jobs)
+            else:
+                h.throttle = Throttle(h.name, h.max_in_flight,
+                                      max_limit=self.jobs)
+
+        self.router = Router(self.hosts)
+
+        self._sessions = dict((h.name, SessionPool(h, self.jobs))
+                              for h in self.hosts)
+        self._pool = None
+
+    @timed('upload', size=lambda result, args: sum(
+        file_size(f) or 0 for f in args[2]),
+        label=lambda args: args[1].name)
+    def _post(self, host, files):
+        sessions = self._sessions[host.name]
+        session = sessions.acquire()
+        try:
+            return host.upload(files, session=session)
+        finally:
+            sessions.release(session)
+
+    def _post_split(self, host, files):
+        size = max(1, host.quantity.max)
+
+        uploaded = []
+        for i in range(0, len(files), size):
+            batch = files[i:i + size]
+            results = list(self._post(host, batch))
+            # None where the links are missing, the next batches stay put
+            uploaded += results + [None] * (len(batch) - len(results))
+
+        return [result and result._replace(host=host.name)
+                for result in uploaded]
+
+    def _route(self, files):
+        """upload `files` to the best host, failing over to the others"""
+        # file objects are sent from where they are now, on every try
+        starts = [(f, f.tell()) for f in files if not isinstance(f, str)]
+
+        errors, partial, partial_count = [], None, 0
+        for host in self.router.candidates(len(files)):
+            for f, start in starts:
+                f.seek(start)
+
+            begin = time.time()
+            try:
+                uploaded = self._post_split(host, files)
+            except Exception as e:
+                errors.append((host, e))
+            else:
+                count = sum(result is not None for result in uploaded)
+                if count == len(files):
+                    self.router.succeeded(host, time.time() - begin,
+                                          len(files))
+                    return uploaded
+
+                errors.append((host, UploadError(
+                    "{} returned the links of {} of {} files".format(
+                        host.name, count, len(files)))))
+                if partial is None or count > partial_count:
+                    partial, partial_count = uploaded, count
+
+            self.router.failed(host)
+            if metrics.enabled:
+                metrics.record('failover', 0.0, label=host.name)
+
+        if partial is not None:  # the links there are beat none
+            return partial
+        if not errors:
+            raise UploadError("No host takes {} files at once".format(
+                len(files)))
+        raise UploadError("Uploading to every host failed: {}".format(
+            '; '.join("{}: {}".format(host.name, e)
+                      for host, e in errors))) from errors[-1][1]
+
+    def _optimized_post(self, files):
+        if self.optimizer is None:
+            return self._route(files)
+
+        uploaded = self._route(self.optimizer.process(files))
+
+        # report the names of the original files
+        return [result and result._replace(filename=_name(f))
+                for f, result in zip(files, uploaded)]
+
+    def _ledger_host(self, host):
+        if self.optimizer is None:
+            return host.name
+
+        # other bytes end up on the host
+        key = host.name + ':{}{}'.format(self.optimizer.fmt,
+                                         self.optimizer.quality)
+        if self.optimizer.max_size:  # the quality is lowered to fit
+            key += ':{}'.format(self.optimizer.max_size)
+
+        return key
+
+    def _lookup(self, digest):
+        for host in self.hosts:
+            urls = self.ledger.lookup(self._ledger_host(host),
+                                      host.thumbnail_size, digest)
+            if urls:
+                return host, urls
+
+        return None, None
+
+    def _upload_batch(self, files):
+        """upload `files`, returns an UploadedFile for each of them, None
+           for those the host returned no links for"""
+        if self.ledger is None:
+            return self._optimized_post(files)
+
+        # keyed on the original files, so repeated uploads are not even
+        # re-encoded
+        digests = [sha256_file(f) for f in files]
+        results = [None] * len(files)
+        if not self.force:
+            for index, (f, digest) in enumerate(zip(files, digests)):
+                host, urls = self._lookup(digest)
+                if urls:
+                    results[index] = UploadedFile(_name(f), *urls,
+                                                  host=host.name)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            hosts = dict((host.name, host) for host in self.hosts)
+            uploaded = self._optimized_post([files[i] for i in missing])
+            for index, result in zip(missing, uploaded):
+                if result is None:
+                    continue
+                results[index] = result
+
+                host = hosts[result.host]
+                self.ledger.record(self._ledger_host(host),
+                                   host.thumbnail_size, digests[index],
+                                   result.page_url, result.thumbnail_url)
+
+        return results
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.jobs)
+
+        return self._pool
+
+    def upload(self, files):
+        return self.upload_groups([files])[0]
+
+    def upload_groups(self, groups):
+        """upload several lists of files concurrently, packed together into
+           as few requests as possible. Returns a list of UploadedFile lists
+           in the order of `groups`, see BatchResult.get()"""
+        batcher = Batcher(self)
+        results = [batcher.add(files) for files in groups]
+        batcher.flush()
+
+        return [result.get() for result in results]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        if self.limits is not None:
+            for host in self.hosts:
+                if host.throttle.responses:
+                    self.limits.record(host.name, host.throttle.limit,
+                                       host.throttle.rate)
+
+        if self.optimizer is not None:
+            self.optimizer.close()
+
+
+class BatchResult(object):
+    """Outcome of the files of one Batcher.add() call, which may be spread
+       over several upload requests. Like a multiprocessing AsyncResult"""
+
+    def __init__(self, count, callback=None, error_callback=None):
+        self._uploads = [None] * count
+        self._remaining = count
+        self._callback = callback
+        self._error_callback = error_callback
+
+        self._error = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+        if not count:
+            self._finish()
+
+    def _value(self):
+        if self._error is not None:
+            raise self._error
+
+        return list(self._uploads)
+
+    def _finish(self):
+        try:
+            if self._error is not None:
+                if self._error_callback is not None:
+                    self._error_callback(self._error)
+            elif self._callback is not None:
+                self._callback(self._value())
+        finally:  # ready once the callbacks are done, like an AsyncResult
+            self._ready.set()
+
+    def _set(self, index, uploaded):
+        with self._lock:
+            if self._error is not None:
+                return
+            self._uploads[index] = uploaded
+            self._remaining -= 1
+            done = self._remaining == 0
+
+        if done:
+            self._finish()
+
+    def _fail(self, error):
+        with self._lock:  # the first error of the requests counts
+            if self._error is not None or self._remaining == 0:
+                return
+            self._error = error
+
+        self._finish()
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def get(self, timeout=None):
+        """the list of UploadedFile tuples, in the order of the files added
+           and None for those the host returned no links for, or raises the
+           error of a failed upload"""
+        if not self._ready.wait(timeout):
+            raise TimeoutError
+
+        return self._value()
+
+
+class Batcher(object):
+    """Packs the files of many add() calls, e.g. the screenshots of many
+       input files, into upload requests of up to `size` files, by default
+       the host's quantity.max, and maps the results back to each call.
+
+    Full requests are sent as soon as there are enough files, the files left
+    over once flush() is called."""
+
+    def __init__(self, uploader, size=None):
+        self.uploader = uploader
+        self.size = size or max(1, uploader.host.quantity.max)
+
+        self._queued = []  # (BatchResult, index, file) not yet sent
+        self._lock = threading.Lock()
+
+    def _take(self, count):
+        taken, self._queued = self._queued[:count], self._queued[count:]
+
+        return [taken[i:i + self.size] for i in range(0, count, self.size)]
+
+    def _send(self, batches):
+        pool = self.uploader._get_pool()
+
+        for batch in batches:
+            pool.apply_async(self.uploader._upload_batch,
+                             ([f for _, _, f in batch],),
+                             callback=partial(self._uploaded, batch),
+                             error_callback=partial(self._failed, batch))
+
+    @staticmethod
+    def _uploaded(batch, uploads):
+        uploads = list(uploads)
+        uploads += [None] * (len(batch) - len(uploads))  # links missing
+
+        for (result, index, _), uploaded in zip(batch, uploads):
+            result._set(index, uploaded)
+
+    @staticmethod
+    def _failed(batch, error):
+        for result, _, _ in batch:
+            result._fail(error)
+
+    def add(self, files, callback=None, error_callback=None):
+        """queue `files` for uploading, returns a BatchResult. `callback` is
+           called with the list of UploadedFile tuples once all of them are
+           uploaded, `error_callback` with the exception if any of the
+           uploads failed, both from a pool thread"""
+        files = list(files)
+        result = BatchResult(len(files), callback, error_callback)
+
+        with self._lock:
+            self._queued += [(result, index, f)
+                             for index, f in enumerate(files)]
+            batches = self._take(len(self._queued) // self.size * self.size)
+
+        self._send(batches)
+
+        return result
+
+    def flush(self):
+        """send the files queued, even if they do not fill a request"""
+        with self._lock:
+            batches = self._take(len(self._queued))
+
+        self._send(batches)
+
+    def pending(self):
+        return len(self._queued)
+
+
 class SpecialImporter(ModuleType):
     default_host = 'imagebam'  # set prefered host, module needs to exist
 
@@ -39,26 +767,62 @@ class SpecialImporter(ModuleType):
         self.__module__ = module
         self.__name__ = module.__name__
 
-        module_filename = inspect.getfile(inspect.currentframe())
-        self._path = os.path.dirname(os.path.abspath(module_filename))
+        self._path = os.path.dirname(os.path.abspath(__file__))
+        self.__path__ = [self._path]  # plugins are imported as submodules
 
-        self.hosts = []
-        for entry in os.listdir(self._path):
-            path = os.path.join(self._path, entry)
+        # the plugin list and host metadata, so that listing the hosts or
+        # checking options against them does not import any plugin. Opened
+        # on first use, in the dir of set_cache_dir() if it was called
+        self._registry_dir = None
+        self._registry_cache = None
+        self._hosts = None
 
-            if os.path.isfile(path) and entry.endswith(".py"):
-                if entry != "__init__.py":
-                    self.hosts.append(entry[:-3])
-            elif os.path.isdir(path) and "__init__.py" in os.listdir(path):
-                self.hosts.append(entry)
+    def set_cache_dir(self, directory):
+        """keep the registry in `directory` instead of utils.cache_dir()"""
+        if directory != self._registry_dir:
+            self._registry_dir = directory
+            self._registry_cache = None
 
-    def _import(self, name):
-        info = imp.find_module(name, [self._path])
+    @property
+    def _registry(self):
+        if self._registry_cache is None:
+            self._registry_cache = FileCache(os.path.join(
+                self._registry_dir or cache_dir(), 'hosts.json'))
+
+        return self._registry_cache
+
+    def _save_registry(self):
         try:
-            module = imp.load_module(name, *info)
-        finally:
-            if info[0]:
-                info[0].close()
+            self._registry.save()
+        except (IOError, OSError):
+            pass
+
+    @property
+    def hosts(self):
+        if self._hosts is None:
+            hosts = self._registry.lookup(self._path)
+            if hosts is None:
+                hosts = []
+                for entry in os.listdir(self._path):
+                    path = os.path.join(self._path, entry)
+
+                    if os.path.isfile(path) and entry.endswith(".py"):
+                        if entry != "__init__.py":
+                            hosts.append(entry[:-3])
+                    elif (os.path.isdir(path) and
+                          "__init__.py" in os.listdir(path)):
+                        hosts.append(entry)
+
+                hosts.sort()
+                self._registry.store(self._path, hosts)
+                self._save_registry()
+
+            self._hosts = hosts
+
+        return self._hosts
+
+    def _import(self, name):
+        module = importlib.import_module(self.__name__ + '.' + name)
 
         setattr(self.__module__, name, module)
 
@@ -72,6 +836,33 @@ class SpecialImporter(ModuleType):
         return getattr(self.__module__, attr)
 
     def get_host(self, host_name):
-        return getattr(self, host_name).Host
+        host = getattr(self, host_name).Host
+        host.name = host_name
+
+        return host
+
+    def host_info(self, host_name):
+        """return the HostInfo of a host, without importing its plugin
+           unless the plugin changed since it was last imported"""
+        if host_name not in self.hosts:
+            raise AttributeError(host_name)
+
+        path = os.path.join(self._path, host_name + '.py')
+        if not os.path.isfile(path):
+            path = os.path.join(self._path, host_name, '__init__.py')
+
+        info = self._registry.lookup(path)
+        if info is None:
+            host = self.get_host(host_name)
+            info = [list(host.quantity), list(host.thumbnail_sizes),
+                    host.thumbnail_size]
+
+            self._registry.store(path, info)
+            self._save_registry()
+
+        quantity, thumbnail_sizes, thumbnail_size = info
+
+        return HostInfo(host_name, UploadRange(*quantity),
+                        tuple(thumbnail_sizes), thumbnail_size)
 
 sys.modules[__name__] = SpecialImporter(sys.modules[__name__])
@@ -1,5 +1,7 @@
 import re
 
+from asu.metrics import timed
+from asu.multipart import MultipartEncoder
 from asu.upload import BaseHost, UploadRange, UploadedFile
 from asu.modules import requests
 
@@ -10,6 +12,8 @@ class Host(BaseHost):
     thumbnail_sizes = (100, 150, 180, 250, 300, 350)
     thumbnail_size = 180
 
+    base_url = 'http://www.imagebam.com/'
+
     def __init__(self, username=None, password=None, thumbnail_size=None):
         self.username = username
         self.password = password
@@ -19,17 +23,18 @@ class Host(BaseHost):
 
         self.uploaded_files = []
 
-    def upload(self, files):
-        sess = requests.session()
-
+    def login(self, session):
         if (self.username, self.password) != (None, None):
-            url = 'http://www.imagebam.com/login'
+            url = self.base_url + 'login'
             data = {'action': 'true', 'nick': self.username,
                     'pw': self.password}
-            resp = sess.post(url, data=data)
+            resp = session.post(url, data=data)
             assert resp.status_code == requests.codes.ok
 
-        url = 'http://www.imagebam.com/sys/upload/save'
+    def upload(self, files, session=None):
+        sess = session or self.new_session()
+
+        url = self.base_url + 'sys/upload/save'
         data = {'content_type': '0',
                 'thumb_size': self.thumbnail_size,
                 'thumb_aspect_ratio': 'resize',
@@ -39,42 +44,37 @@ class Host(BaseHost):
                 'galley_description': ''}
 
         data_files = []
-        opened_files = []
         uploaded_names = []
-        try:  # finally close the files that were opened
-            for count, f in enumerate(files, 1):
-                upload_name = 'image{:02}.png'.format(count)
+        for count, f in enumerate(files, 1):
+            upload_name = self.upload_name(f, count)
 
-                if isinstance(f, str):
-                    open_file = open(f, 'rb')
-                    opened_files.append(open_file)
+            if isinstance(f, str):
+                uploaded_names.append(f)
+            else:
+                filename = getattr(f, 'name', None) or upload_name
+                uploaded_names.append(filename)
 
-                    uploaded_names.append(f)
-                else:
-                    open_file = f
+            # paths are read while the request is sent
+            data_files.append(('file[]', (upload_name, f)))
 
-                    filename = getattr(f, 'name', None) or upload_name
-                    uploaded_names.append(filename)
-
-                data_files.append(('file[]', (upload_name, open_file)))
-
-            resp = sess.post(url, data=data, files=data_files)
-            assert resp.status_code == requests.codes.ok
+        body = MultipartEncoder(data.items(), data_files,
+                                progress=self.progress)
+        resp = sess.post(url, data=body,
+                         headers={'Content-Type': body.content_type})
+        assert resp.status_code == requests.codes.ok
 
-            self._html = resp.text
-        finally:
-            for open_file in opened_files:
-                open_file.close()
+        html = self._html = resp.text
 
         uploaded = []
-        for fn, (pu, tu) in zip(uploaded_names, self._get_links(self._html)):
+        for fn, (pu, tu) in zip(uploaded_names, self._get_links(html)):
             uploaded.append(UploadedFile(fn, pu, tu))
 
-        self.uploaded_files += uploaded
+        self.uploaded_files.extend(uploaded)
 
         return uploaded
 
     @staticmethod
+    @timed('parse_links', size=lambda links, args: len(args[0]))
     def _get_links(html):
         """return a list of tuples, each tuple containing the image page link
            and the direct link to the thumbnail file"""
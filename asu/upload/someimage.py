@@ -1,5 +1,7 @@
 import re
 
+from asu.metrics import timed
+from asu.multipart import MultipartEncoder
 from asu.upload import BaseHost, UploadRange, UploadedFile
 from asu.modules import requests
 
@@ -10,6 +12,11 @@ class Host(BaseHost):
     thumbnail_sizes = (100, 150, 200, 250, 300, 350)
     thumbnail_size = 200
 
+    # uploads are collected per session on the 'done' page
+    stateful_session = True
+
+    base_url = 'http://someimage.com/'
+
     def __init__(self, username=None, password=None, thumbnail_size=None):
         self.username = username
         self.password = password
@@ -19,23 +26,23 @@ class Host(BaseHost):
 
         self.uploaded_files = []
 
-    def upload(self, files):
-        base_url = 'http://someimage.com/'
-        upload_url = base_url + 'upload.php'
-        retrieve_url = base_url + 'done'
-
-        sess = requests.session()
-
+    def login(self, session):
         if (self.username, self.password) != (None, None):
-            login_url = base_url + 'index.php'
+            login_url = self.base_url + 'index.php'
             data = {'act': 'takelogin',
                     'username': self.username,
                     'password': self.password}
 
-            resp = sess.post(login_url, data=data)
+            resp = session.post(login_url, data=data)
             assert resp.status_code == requests.codes.ok
         else:
-            assert sess.get(base_url).status_code == requests.codes.ok
+            assert session.get(self.base_url).status_code == requests.codes.ok
+
+    def upload(self, files, session=None):
+        upload_url = self.base_url + 'upload.php'
+        retrieve_url = self.base_url + 'done'
+
+        sess = session or self.new_session()
 
         data = {'name': None,  # set in loop
                 'safe': '1',
@@ -45,39 +52,39 @@ class Host(BaseHost):
 
         uploaded_names = []
         for count, f in enumerate(files, 1):
-            data['name'] = 'image{:02}.png'.format(count)
+            data['name'] = self.upload_name(f, count)
 
-            open_file = None
             if isinstance(f, str):
-                upfile = open_file = open(f, 'rb')
                 uploaded_names.append(f)
             else:
-                upfile = f
                 uploaded_names.append(getattr(f, 'name', None) or data['name'])
 
-            try:
-                data_files = (('file', (data['name'], upfile)),)
-
-                resp = sess.post(upload_url, data=data, files=data_files)
+            body = MultipartEncoder(data.items(),
+                                    (('file', (data['name'], f)),),
+                                    progress=self.progress)
+            resp = sess.post(upload_url, data=body,
+                             headers={'Content-Type': body.content_type})
 
-                assert resp.status_code == requests.codes.ok
-            finally:
-                if open_file:
-                    open_file.close()
+            assert resp.status_code == requests.codes.ok
 
         resp = sess.get(retrieve_url)
 
         self._html = resp.text
 
+        # a reused session may list earlier uploads as well, the files of
+        # this call are the last ones on the page
+        links = self._get_links(resp.text)[-len(uploaded_names):]
+
         uploaded = []
-        for fn, (pu, tu) in zip(uploaded_names, self._get_links(resp.text)):
+        for fn, (pu, tu) in zip(uploaded_names, links):
             uploaded.append(UploadedFile(fn, pu, tu))
 
-        self.uploaded_files += uploaded
+        self.uploaded_files.extend(uploaded)
 
         return uploaded
 
     @staticmethod
+    @timed('parse_links', size=lambda links, args: len(args[0]))
     def _get_links(html):
         """return a list of tuples, each tuple containing the image page link
            and the direct link to the thumbnail file"""
@@ -3,9 +3,19 @@ from __future__ import print_function
 import os
 import sys
 import re
+import hashlib
 import subprocess
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
 
 from . import DEFAULT_FFMPEG_COMMAND
+from .metrics import timed, file_size
+
+
+def info(*args, **kwargs):
+    print("Info:", *args, file=sys.stderr, **kwargs)
 
 
 def warn(*args, **kwargs):
@@ -37,6 +47,27 @@ def regex_in_string(regex, string):
         return match.group()
 
 
+@timed('hash', size=lambda digest, args: file_size(args[0]))
+def sha256_file(file, chunk_size=1024 * 1024):
+    """hex sha256 digest of a path or file object, read in chunks"""
+    digest = hashlib.sha256()
+
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    else:
+        position = file.tell()
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+        file.seek(position)
+
+    return digest.hexdigest()
+
+
+@timed('subprocess', size=lambda result, args: len(result[1] or b''),
+       status=lambda result: result[0],
+       label=lambda args: os.path.basename(args[0]))
 def run_command(executeable, *args, **kwargs):
     stdout = kwargs.pop('stdout', subprocess.PIPE)
     stderr = kwargs.pop('stderr', subprocess.PIPE)
@@ -54,13 +85,37 @@ def run_command(executeable, *args, **kwargs):
     return proc.returncode, stdout, stderr
 
 
-def ffmpeg_version(ffmpeg):
+def ffmpeg_version(ffmpeg, cache=None):
+    """return the version line of `ffmpeg`, None if it does not look
+       compatible or False if it could not be run. Kept in `cache`, a
+       FileCache, for the executable `ffmpeg` resolves to"""
+    path = which(ffmpeg) if cache is not None else None
+    if path:
+        cached = cache.lookup(path)
+        if cached is not None:
+            return cached[0]
+
     re_version = re.compile(r'^(ffmpeg|avconv) version.*$')
     retcode, stdout, _ = run_command(ffmpeg, '-version')
 
     if retcode != 0:
         return False
-    return regex_in_string(re_version, stdout.decode().split('\n')[0])
+    version = regex_in_string(re_version, stdout.decode().split('\n')[0])
+
+    if path:
+        cache.store(path, [version])
+
+    return version
+
+
+def cache_dir():
+    if 'win32' in sys.platform:
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = (os.environ.get('XDG_CACHE_HOME') or
+                os.path.join(os.path.expanduser('~'), '.cache'))
+
+    return os.path.join(base, 'asu')
 
 
 def ffmpeg_exe(path=None, default=None):
@@ -73,3 +128,14 @@ def ffmpeg_exe(path=None, default=None):
             return ffmpeg
 
     return default or DEFAULT_FFMPEG_COMMAND
+
+
+def ffprobe_exe(ffmpeg=None):
+    """path of the ffprobe executable shipped next to `ffmpeg`"""
+    head, tail = os.path.split(ffmpeg or ffmpeg_exe())
+
+    for name, probe_name in (('ffmpeg', 'ffprobe'), ('avconv', 'avprobe')):
+        if name in tail:
+            return os.path.join(head, tail.replace(name, probe_name, 1))
+
+    return os.path.join(head, 'ffprobe')
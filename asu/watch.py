@@ -0,0 +1,115 @@
+import os
+import time
+import threading
+
+from .cache import file_key
+from .discover import walk, name_prefix
+from .file_type import InputFile
+
+# seconds between two scans of the watched directories
+DEFAULT_INTERVAL = 5.0
+# seconds the size and modification time of a new file need to stay the same
+# before it is considered completely written
+DEFAULT_SETTLE = 10.0
+
+
+class Watcher(object):
+    """Endless iterable of the input files appearing in a set of directories.
+
+    The directories are scanned every `interval` seconds. A new or changed
+    file is handed out as an InputFile once its size and modification time
+    did not change for `settle` seconds, files for which `skip(input_file)`
+    is true are left alone. Iteration ends after stop() is called."""
+
+    def __init__(self, directories, interval=None, settle=None, skip=None,
+                 recursive=False, max_depth=None, include=(), exclude=()):
+        self.directories = directories
+        self.interval = DEFAULT_INTERVAL if interval is None else interval
+        self.settle = DEFAULT_SETTLE if settle is None else settle
+        self.skip = skip
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.include = include
+        self.exclude = exclude
+
+        self._changes = {}  # path -> ((size, mtime), time the change was seen)
+        self._handed_out = {}  # path -> file_key() when it was handed out
+        self._failed = {}  # path -> file_key() when it failed, see failed()
+        self._stopped = threading.Event()
+
+    def _settled(self, path, now):
+        try:
+            stat = os.stat(path)
+        except OSError:  # deleted again
+            return False
+
+        state = (stat.st_size, stat.st_mtime)
+        last = self._changes.get(path)
+        if last is None or last[0] != state:
+            self._changes[path] = (state, now)
+            return False
+
+        return stat.st_size > 0 and now - last[1] >= self.settle
+
+    def poll(self):
+        """scan the directories once, returns the InputFiles which are ready
+           to be processed"""
+        now = time.time()
+        found = set()
+        ready = []
+
+        for directory in self.directories:
+            for path in walk(directory, self.recursive, self.max_depth,
+                             self.include, self.exclude):
+                found.add(path)
+                if not self._settled(path, now):
+                    continue
+
+                try:
+                    key = file_key(path)
+                except OSError:
+                    continue
+                if key in (self._handed_out.get(path),
+                           self._failed.get(path)):
+                    continue
+                self._handed_out[path] = key
+
+                input_file = InputFile(path, name_prefix(directory, path))
+                if self.skip is None or not self.skip(input_file):
+                    ready.append(input_file)
+
+        for path in set(self._changes) - found:
+            del self._changes[path]
+        for path in set(self._handed_out) - found:
+            del self._handed_out[path]
+        for path in set(self._failed) - found:
+            del self._failed[path]
+
+        return ready
+
+    def failed(self, input_file):
+        """do not hand out a file which could not be processed again, even
+           after reset(), until it changes"""
+        try:
+            self._failed[input_file.path] = file_key(input_file.path)
+        except OSError:
+            pass
+
+    def reset(self):
+        """forget which files were handed out, so that those which are not
+           skipped are handed out again, except for failed() ones, and allow
+           iterating again after stop()"""
+        self._handed_out.clear()
+        self._stopped.clear()
+
+    def stop(self):
+        self._stopped.set()
+
+    def __iter__(self):
+        while not self._stopped.is_set():
+            for input_file in self.poll():
+                if self._stopped.is_set():
+                    return
+                yield input_file
+
+            self._stopped.wait(self.interval)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Compare the wall time of the screenshot extraction modes on the same
+input files.
+
+usage: extract_modes.py [-n AMOUNT] [-j JOBS] [-r RUNS] <input> [<input> ...]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from asu.extract import Extractor, MODES  # noqa: E402
+from asu.file_type import InputFile  # noqa: E402
+from asu.utils import ffmpeg_exe  # noqa: E402
+
+
+def bench(mode, paths, amount, jobs, frame_accurate):
+    input_files = [InputFile(path) for path in paths]
+    for input_file in input_files:  # keep probing out of the measurement
+        input_file.get_duration(ffmpeg_exe())
+
+    output_dir = tempfile.mkdtemp(prefix='asu-bench-')
+    try:
+        extractor = Extractor(jobs=jobs, ffmpeg=ffmpeg_exe(),
+                              frame_accurate=frame_accurate, mode=mode)
+
+        start = time.time()
+        extractor.run(input_files, amount, output_dir)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(output_dir)
+
+    taken = sum(len(input_file.screenshots) for input_file in input_files)
+    return elapsed, taken
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options] <input> ...')
+    parser.add_option('-n', dest='amount', type='int', default=6)
+    parser.add_option('-j', dest='jobs', type='int', default=1)
+    parser.add_option('-r', dest='runs', type='int', default=3)
+    parser.add_option('--frame-accurate', dest='frame_accurate',
+                      action='store_true', default=False)
+    options, paths = parser.parse_args()
+
+    if not paths:
+        parser.error('no input files given')
+
+    for mode in MODES:
+        times = []
+        for _ in range(options.runs):
+            elapsed, taken = bench(mode, paths, options.amount,
+                                   options.jobs, options.frame_accurate)
+            times.append(elapsed)
+
+        print("{:<8} best {:.3f}s  mean {:.3f}s  ({} screenshots)".format(
+            mode, min(times), sum(times) / len(times), taken))
+
+
+if __name__ == '__main__':
+    main()
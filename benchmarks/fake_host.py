@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""Local stand-in for the upload and result pages of the imagebam and
+someimage hosts, so that the host plugins can be benchmarked without
+network access or accounts.
+
+usage: fake_host.py [-p PORT] [--latency SECONDS] [--bandwidth BYTES]
+"""
+from __future__ import print_function
+
+import time
+import uuid
+import threading
+from optparse import OptionParser
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+LINK = '[URL={0}image/{1}][IMG]{0}thumb/{1}.jpg[/IMG][/URL]'
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real hosts
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        fake_host = self.server.fake_host
+        fake_host.count(len(body))
+
+        delay = fake_host.latency
+        if fake_host.bandwidth:
+            delay += len(body) / float(fake_host.bandwidth)
+        if delay:
+            time.sleep(delay)
+
+        return body
+
+    def _session(self):
+        for cookie in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == 'sid':
+                return value, False
+
+        return uuid.uuid4().hex, True
+
+    def _reply(self, html, sid=None):
+        data = html.encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if sid is not None:
+            self.send_header('Set-Cookie', 'sid={}; Path=/'.format(sid))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _links(self, ids):
+        return '\n'.join("<input value='{}' />".format(
+            LINK.format(self.server.fake_host.url, i)) for i in ids)
+
+    def do_GET(self):
+        self._read_body()
+        sid, new = self._session()
+
+        if self.path == '/done':  # someimage: uploads of the session
+            ids = self.server.fake_host.sessions.get(sid, [])
+            self._reply('<html>{}</html>'.format(self._links(ids)))
+        else:
+            self._reply('<html></html>', sid if new else None)
+
+    def do_POST(self):
+        body = self._read_body()
+        sid, new = self._session()
+        fake_host = self.server.fake_host
+
+        if self.path == '/sys/upload/save':  # imagebam: all files at once
+            ids = fake_host.new_ids(body.count(b'name="file[]"'))
+            self._reply('<html>{}</html>'.format(self._links(ids)))
+        elif self.path == '/upload.php':  # someimage: one file per request
+            ids = fake_host.new_ids(body.count(b'name="file"'))
+            with fake_host.lock:
+                fake_host.sessions.setdefault(sid, []).extend(ids)
+            self._reply('<html></html>', sid if new else None)
+        else:  # logins
+            self._reply('<html></html>', sid if new else None)
+
+
+class FakeHost(object):
+    """Serves the fake host pages from a background thread.
+
+    Every request is delayed by `latency` seconds plus its body size divided
+    by `bandwidth` bytes per second, if given."""
+
+    def __init__(self, port=0, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.requests = 0
+        self.bytes_received = 0
+        self._next_id = 0
+
+        self.server = ThreadingServer(('127.0.0.1', port), Handler)
+        self.server.fake_host = self
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+        self._thread = None
+
+    def count(self, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += size
+
+    def new_ids(self, amount):
+        with self.lock:
+            start = self._next_id
+            self._next_id += amount
+
+        return range(start, start + amount)
+
+    def patch(self, host_class):
+        """point a host plugin class at this server"""
+        host_class.base_url = self.url
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-p', '--port', dest='port', type='int', default=8000)
+    parser.add_option('--latency', dest='latency', type='float', default=0)
+    parser.add_option('--bandwidth', dest='bandwidth', type='int')
+    options, _ = parser.parse_args()
+
+    fake_host = FakeHost(options.port, options.latency, options.bandwidth)
+    print("Serving fake image hosts on", fake_host.url)
+    try:
+        fake_host.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
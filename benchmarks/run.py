@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""Benchmark the extraction and upload hot paths of asu on synthetic test
+videos, uploading to a local fake image host.
+
+Every stage is timed over several samples; the results are written as json
+so that they can be compared across revisions with --compare.
+
+usage: run.py [options]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import asu  # noqa: E402
+from asu import upload, VALID_INPUT_FILE_EXTENSIONS  # noqa: E402
+from asu.extract import Extractor, MODES  # noqa: E402
+from asu.file_type import InputFile, HtmlFile, ScreenshotFile  # noqa: E402
+from asu.pipeline import Pipeline  # noqa: E402
+from asu.utils import cache_dir, ffmpeg_exe, run_command  # noqa: E402
+
+from fake_host import FakeHost  # noqa: E402
+import videos  # noqa: E402
+
+STAGES = ('startup', 'probe', 'screenshot', 'extract', 'html', 'upload',
+          'pipeline')
+HOSTS = ('imagebam', 'someimage')
+
+# a stage of the new results is reported as a regression if its median is
+# this much higher than in the old results
+REGRESSION = 1.10
+
+
+def summarize(samples, items=1, unit='item'):
+    """statistics of a list of durations, each of which processed `items`
+       `unit`s"""
+    samples = sorted(samples)
+    total = sum(samples)
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    return {'samples': len(samples),
+            'min': samples[0],
+            'median': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': samples[-1],
+            'mean': total / len(samples),
+            'unit': unit,
+            'throughput': items * len(samples) / total if total else None}
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+
+    return time.time() - start, result
+
+
+def bench_startup(paths, runs, ffmpeg, results):
+    """time new asu processes: importing asu, listing the hosts and a
+       '--no-upload' run of one screenshot. 'cold' runs start with an empty
+       cache dir, 'warm' ones with the host registry and ffmpeg version
+       already cached"""
+    cache_home = tempfile.mkdtemp(prefix='asu-bench-cache-')
+    output_dir = tempfile.mkdtemp(prefix='asu-bench-startup-')
+    env = dict(os.environ, XDG_CACHE_HOME=cache_home,
+               PYTHONPATH=os.path.dirname(BENCH_DIR))
+
+    config = os.path.join(output_dir, 'asu.cfg')
+    with open(config, 'w') as file:
+        file.write('[asu]\nffmpeg_command = {}\n'.format(ffmpeg))
+
+    commands = {'import': ['-c', 'import asu.main'],
+                'hosts': ['-m', 'asu', '--hosts'],
+                'no_upload': ['-m', 'asu', '-c', config, '-N', '-n', '1',
+                              '-o', output_dir, '--no-probe-cache',
+                              paths[0]]}
+    try:
+        for name, args in sorted(commands.items()):
+            for state in ('cold', 'warm'):
+                samples = []
+                for _ in range(runs):
+                    if state == 'cold':
+                        shutil.rmtree(cache_home, ignore_errors=True)
+
+                    with open(os.devnull, 'w') as devnull:
+                        start = time.time()
+                        subprocess.check_call([sys.executable] + args,
+                                              env=env, stdout=devnull)
+                        samples.append(time.time() - start)
+
+                results['startup.{}.{}'.format(name, state)] = summarize(
+                    samples, unit='process')
+    finally:
+        shutil.rmtree(cache_home, ignore_errors=True)
+        shutil.rmtree(output_dir)
+
+
+def bench_probe(paths, runs, ffmpeg, results):
+    all_samples = []
+    for path in paths:
+        samples = []
+        for _ in range(runs):
+            input_file = InputFile(path)  # nothing cached
+            samples.append(timed(input_file.get_duration, ffmpeg)[0])
+
+        ext = os.path.splitext(path)[1].strip('.')
+        results['probe.' + ext] = summarize(samples, unit='file')
+        all_samples += samples
+
+    results['probe'] = summarize(all_samples, unit='file')
+
+
+def bench_screenshot(paths, runs, ffmpeg, output_dir, results):
+    all_samples = []
+    for path in paths:
+        input_file = InputFile(path)
+        timecode = input_file.get_duration(ffmpeg).seconds / 2
+
+        samples = []
+        for run in range(runs):
+            output = os.path.join(output_dir, 'single{}.png'.format(run))
+            samples.append(timed(input_file.extract_screenshot, output,
+                                 timecode, ffmpeg)[0])
+
+        ext = os.path.splitext(path)[1].strip('.')
+        results['screenshot.' + ext] = summarize(samples, unit='screenshot')
+        all_samples += samples
+
+    results['screenshot'] = summarize(all_samples, unit='screenshot')
+
+
+def bench_extract(paths, runs, amount, jobs, ffmpeg, output_dir, results):
+    """returns the paths of the screenshots taken by the last run"""
+    screenshots = []
+    for mode in MODES:
+        samples = []
+        for _ in range(runs):
+            input_files = [InputFile(path) for path in paths]
+            for input_file in input_files:  # keep probing out of it
+                input_file.get_duration(ffmpeg)
+
+            extractor = Extractor(jobs=jobs, ffmpeg=ffmpeg, mode=mode)
+            samples.append(timed(extractor.run, input_files, amount,
+                                 output_dir)[0])
+
+            screenshots = [ss.path for input_file in input_files
+                           for ss in input_file.screenshots]
+
+        results['extract.' + mode] = summarize(
+            samples, items=len(screenshots), unit='screenshot')
+
+    return screenshots
+
+
+def bench_html(runs, sections, results):
+    input_file = InputFile('benchmark.mkv')
+    for n in range(1, 11):
+        screenshot = ScreenshotFile('benchmark{:02}.png'.format(n), n * 60,
+                                    input_file)
+        screenshot.page_url = 'http://example.com/image/{}'.format(n)
+        screenshot.thumbnail_url = 'http://example.com/thumb/{}.jpg'.format(n)
+        input_file.screenshots.append(screenshot)
+
+    directory = tempfile.mkdtemp(prefix='asu-bench-html-')
+    try:
+        samples = []
+        for _ in range(runs):
+            html_file = HtmlFile(os.path.join(directory, 'out.html'))
+            for _ in range(sections):
+                html_file.add_section(input_file)
+
+            samples.append(timed(html_file.write)[0])
+
+        # a section written out as each file finishes
+        stream_samples = []
+        for _ in range(runs):
+            html_file = HtmlFile(os.path.join(directory, 'stream.html'))
+            start = time.time()
+            for _ in range(sections):
+                html_file.append_section(input_file)
+            html_file.close()
+            stream_samples.append(time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+    results['html'] = summarize(samples, items=sections, unit='section')
+    results['html.stream'] = summarize(stream_samples, items=sections,
+                                       unit='section')
+
+
+def bench_upload(screenshots, runs, fake_host, results):
+    for host_name in HOSTS:
+        Host = upload.get_host(host_name)
+        fake_host.patch(Host)
+        host = Host()
+
+        batch = screenshots[:max(1, Host.quantity.max)]
+        size = sum(os.path.getsize(path) for path in batch)
+        session = host.new_session()
+
+        samples = []
+        for _ in range(runs):
+            samples.append(timed(host.upload, batch, session)[0])
+
+        results['upload.' + host_name] = summarize(
+            samples, items=len(batch), unit='screenshot')
+        results['upload.' + host_name]['bytes_per_second'] = (
+            size * len(samples) / sum(samples))
+
+
+def bench_pipeline(paths, runs, amount, jobs, ffmpeg, output_dir,
+                   fake_host, results):
+    Host = upload.get_host('imagebam')
+    fake_host.patch(Host)
+
+    samples = []
+    for _ in range(runs):
+        input_files = [InputFile(path) for path in paths]
+
+        uploader = upload.Uploader(Host())
+        pipeline = Pipeline(Extractor(jobs=jobs, ffmpeg=ffmpeg), uploader)
+        try:
+            samples.append(timed(lambda: list(pipeline.run(
+                input_files, amount, output_dir)))[0])
+        finally:
+            uploader.close()
+
+    results['pipeline'] = summarize(samples, items=len(paths), unit='file')
+
+
+def metadata(options, ffmpeg):
+    try:
+        revision = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=BENCH_DIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    _, stdout, _ = run_command(ffmpeg, '-version')
+
+    return {'revision': revision,
+            'asu_version': asu.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'ffmpeg': stdout.decode('utf-8', 'replace').split('\n')[0],
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'options': options}
+
+
+def compare(old, new):
+    print("{:<24} {:>10} {:>10} {:>8}".format('stage', 'old', 'new',
+                                              'ratio'))
+    for stage in sorted(new['stages']):
+        if stage not in old['stages']:
+            continue
+
+        before = old['stages'][stage]['median']
+        after = new['stages'][stage]['median']
+        ratio = after / before if before else float('inf')
+
+        print("{:<24} {:>9.4f}s {:>9.4f}s {:>7.2f}x{}".format(
+            stage, before, after, ratio,
+            '  slower' if ratio > REGRESSION else ''))
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-o', dest='output',
+                      help="results file, default: results-<revision>.json")
+    parser.add_option('--compare', dest='compare',
+                      help="results file of an earlier run to compare with")
+    parser.add_option('--stages', dest='stages', default=','.join(STAGES),
+                      help="comma separated stages to run, default: all")
+    parser.add_option('--containers', dest='containers',
+                      default=','.join(VALID_INPUT_FILE_EXTENSIONS))
+    parser.add_option('--video-dir', dest='video_dir',
+                      default=os.path.join(cache_dir(), 'benchmark-videos'))
+    parser.add_option('-d', dest='duration', type='int',
+                      default=videos.DEFAULT_DURATION)
+    parser.add_option('-s', dest='size', default=videos.DEFAULT_SIZE)
+    parser.add_option('-n', dest='amount', type='int', default=6)
+    parser.add_option('-j', dest='jobs', type='int', default=0)
+    parser.add_option('-r', dest='runs', type='int', default=5)
+    parser.add_option('--html-sections', dest='html_sections', type='int',
+                      default=200)
+    parser.add_option('--latency', dest='latency', type='float', default=0,
+                      help="seconds added to every fake host request")
+    parser.add_option('--bandwidth', dest='bandwidth', type='int',
+                      help="upload bytes per second of the fake host")
+    options, _ = parser.parse_args()
+
+    stages = options.stages.split(',')
+    ffmpeg = ffmpeg_exe()
+
+    print("Generating test videos in", options.video_dir)
+    paths = videos.generate(options.video_dir, options.containers.split(','),
+                            options.duration, options.size, ffmpeg)
+
+    fake_host = FakeHost(latency=options.latency,
+                         bandwidth=options.bandwidth).start()
+    output_dir = tempfile.mkdtemp(prefix='asu-bench-')
+
+    results = {}
+    try:
+        if 'startup' in stages:
+            bench_startup(paths, options.runs, ffmpeg, results)
+        if 'probe' in stages:
+            bench_probe(paths, options.runs, ffmpeg, results)
+        if 'screenshot' in stages:
+            bench_screenshot(paths, options.runs, ffmpeg, output_dir,
+                             results)
+
+        screenshots = []
+        if set(stages) & set(('extract', 'upload')):
+            screenshots = bench_extract(paths, options.runs, options.amount,
+                                        options.jobs, ffmpeg, output_dir,
+                                        results)
+
+        if 'html' in stages:
+            bench_html(options.runs, options.html_sections, results)
+        if 'upload' in stages:
+            bench_upload(screenshots, options.runs, fake_host, results)
+        if 'pipeline' in stages:
+            bench_pipeline(paths, options.runs, options.amount, options.jobs,
+                           ffmpeg, output_dir, fake_host, results)
+    finally:
+        fake_host.stop()
+        shutil.rmtree(output_dir)
+
+    report = {'meta': metadata(options.__dict__, ffmpeg), 'stages': results}
+
+    for stage in sorted(results):
+        stats = results[stage]
+        print("{:<24} median {:.4f}s  p95 {:.4f}s  {:.1f} {}/s".format(
+            stage, stats['median'], stats['p95'], stats['throughput'] or 0,
+            stats['unit']))
+
+    output = options.output or 'results-{}.json'.format(
+        report['meta']['revision'])
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    print("Results written to", output)
+
+    if options.compare:
+        with open(options.compare) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Generate synthetic test videos with ffmpeg's testsrc source, one per
+container of VALID_INPUT_FILE_EXTENSIONS. Existing videos are reused.
+
+usage: videos.py [-d DURATION] [-s SIZE] <output dir> [<container> ...]
+"""
+from __future__ import print_function
+
+import os
+import sys
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from asu import VALID_INPUT_FILE_EXTENSIONS  # noqa: E402
+from asu.utils import ffmpeg_exe, run_command  # noqa: E402
+
+H264 = ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+        '-g', '48']
+MPEG2 = ['-c:v', 'mpeg2video', '-b:v', '4M', '-g', '15']
+
+# output options of each container, with a codec commonly found in it
+CONTAINERS = {'mkv': H264,
+              'mp4': H264 + ['-movflags', '+faststart'],
+              'avi': ['-c:v', 'mpeg4', '-q:v', '4', '-g', '48'],
+              'ts': H264 + ['-f', 'mpegts'],
+              'm2ts': H264 + ['-f', 'mpegts', '-mpegts_m2ts_mode', '1'],
+              'vob': MPEG2 + ['-f', 'vob']}
+
+DEFAULT_DURATION = 120  # seconds
+DEFAULT_SIZE = '1280x720'
+
+
+def generate(output_dir, containers=VALID_INPUT_FILE_EXTENSIONS,
+             duration=DEFAULT_DURATION, size=DEFAULT_SIZE, ffmpeg=None):
+    """return the paths of the test videos, generating missing ones"""
+    ffmpeg = ffmpeg or ffmpeg_exe()
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    paths = []
+    for container in containers:
+        path = os.path.join(output_dir, 'testsrc_{}_{}s.{}'.format(
+            size, duration, container))
+
+        if not os.path.isfile(path):
+            source = 'testsrc=duration={}:size={}:rate=25'.format(duration,
+                                                                   size)
+            retcode, _, stderr = run_command(
+                ffmpeg, '-v', 'error', '-y', '-f', 'lavfi', '-i', source,
+                *(CONTAINERS[container] + [path]))
+            if retcode != 0:
+                raise RuntimeError("Failed to generate '{}': {}".format(
+                    path, stderr.decode('utf-8', 'replace').strip()))
+
+        paths.append(path)
+
+    return paths
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options] <output dir> '
+                                '[<container> ...]')
+    parser.add_option('-d', dest='duration', type='int',
+                      default=DEFAULT_DURATION)
+    parser.add_option('-s', dest='size', default=DEFAULT_SIZE)
+    options, args = parser.parse_args()
+
+    if not args:
+        parser.error('no output dir given')
+
+    for path in generate(args[0], args[1:] or VALID_INPUT_FILE_EXTENSIONS,
+                         options.duration, options.size):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()